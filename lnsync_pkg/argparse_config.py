@@ -381,13 +381,14 @@ class ArgumentParserConfig(ArgumentParserConfigSubparser):
         cfg_parser.optionxform = hyphens_to_underscores
         read_files = None
         for fname in filenames:
-            if os.path.exists(fname):
-                try:
-                    read_files = cfg_parser.read(fname)
-                except configparser.ParsingError as exc:
-                    raise ConfigError(str(exc)) from exc
-                if read_files:
-                    break
+            # ConfigParser.read skips files it cannot open, so there is no
+            # need to stat each candidate location beforehand.
+            try:
+                read_files = cfg_parser.read(fname)
+            except configparser.ParsingError as exc:
+                raise ConfigError(str(exc)) from exc
+            if read_files:
+                break
         if not read_files:
             raise NoValidConfigFile(
                 "trying to read: %s" % (",".join(filenames),))
@@ -211,10 +211,7 @@ class ScOptArgAction(argparse.Action):
     def _sc_action_store_bool(self, _parser, namespace,
                               pos_val, _opt_val, option_string):
         sc_ns = self.sc_get_namespace(pos_val)
-        if option_string[0:5] == "--no-":
-            val = False
-        else:
-            val = True
+        val = not option_string.startswith("--no-")
         setattr(sc_ns, self.sc_dest, val)
         if self.sc_scope == Scope.ALL:
             setattr(namespace, self.dest, val)
@@ -298,6 +295,14 @@ class ScPosArgAction(argparse.Action):
                     not in (Scope.NEXT, Scope.NEXT_SINGLE))
         sc_data.store_pos_arg(pos_arg)
 
+    @staticmethod
+    def iter_pos_args(namespace):
+        """
+        Iterate over all scoped positional argument values parsed into
+        namespace, in command line order.
+        """
+        return _SCPrivateData.for_namespace(namespace).iter_pos_args()
+
     @staticmethod
     def _fill_in_defaults(parser, namespace, pos_arg):
         for action in parser._actions:
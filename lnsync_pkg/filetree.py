@@ -37,6 +37,7 @@ are reversible, except those that delete a file's only path.
 # pylint: disable=too-many-public-methods, too-many-instance-attributes
 
 import os
+import sys
 
 import lnsync_pkg.printutils as pr
 from lnsync_pkg.filesystems import make_id_computer
@@ -539,9 +540,20 @@ class FileTree:
         """
         dir_relpath = dir_obj.get_relpath()
         dir_abspath = self.rel_to_abs(dir_relpath)
-        for obj_bname in os.listdir(dir_abspath):
-            obj_abspath = os.path.join(dir_abspath, obj_bname)
-            if os.path.islink(obj_abspath): # This must be tested for first.
+        # Basenames are plain path components, so concatenate instead of
+        # calling os.path.join per entry.
+        abs_prefix = dir_abspath if dir_abspath[-1:] == os.sep \
+                     else dir_abspath + os.sep
+        rel_prefix = dir_relpath + os.sep if dir_relpath else ""
+        # Entry types come from the directory listing itself, where the OS
+        # provides them, saving a stat call per test.
+        with os.scandir(dir_abspath) as dir_entries:
+            entries = list(dir_entries)
+        for entry in entries:
+            # Basenames recur across dirs and are kept as entries keys.
+            obj_bname = sys.intern(entry.name)
+            obj_abspath = abs_prefix + obj_bname
+            if entry.is_symlink(): # This must be tested for first.
                 if glob_matcher \
                         and glob_matcher.exclude_file_bname(obj_bname):
                     pr.debug("excluded symlink %s", obj_abspath)
@@ -549,7 +561,7 @@ class FileTree:
                 else:
                     pr.debug("ignored symlink %s", obj_abspath)
                     yield (obj_bname, None, OtherItem, None)
-            elif os.path.isfile(obj_abspath):
+            elif entry.is_file(follow_symlinks=False):
                 if glob_matcher \
                         and glob_matcher.exclude_file_bname(obj_bname):
                     pr.debug("excluded file %s", obj_abspath)
@@ -558,12 +570,12 @@ class FileTree:
                     pr.debug("ignored no-read-access file %s", obj_abspath)
                     yield (obj_bname, None, OtherItem, None)
                 else:
-                    obj_relpath = os.path.join(dir_relpath, obj_bname)
+                    obj_relpath = rel_prefix + obj_bname
                     pr.progress(obj_relpath)
-                    stat_data = os.stat(obj_abspath)
+                    stat_data = entry.stat(follow_symlinks=False)
                     fid = self._id_computer.get_id(obj_relpath, stat_data)
                     yield (obj_bname, fid, FileItem, stat_data)
-            elif os.path.isdir(obj_abspath):
+            elif entry.is_dir(follow_symlinks=False):
                 if glob_matcher \
                         and glob_matcher.exclude_dir_bname(obj_bname):
                     pr.debug("excluded dir %s", obj_abspath)
@@ -600,7 +612,9 @@ class FileTree:
                 else:
                     self._size_to_files[f_size] = [file_obj]
         dir_obj.add_entry(fbasename, file_obj)
-        relpath = os.path.join(dir_obj.get_relpath(), fbasename)
+        dir_relpath = dir_obj.get_relpath()
+        relpath = dir_relpath + os.sep + fbasename if dir_relpath \
+                  else fbasename
         file_obj.relpaths.append(relpath)
 
     def rm_path(self, file_obj, dir_obj, fbasename):
@@ -642,18 +656,17 @@ class FileTree:
             "path_to_obj: no rootdir_obj."
         curdir_obj = self.rootdir_obj
         components = relpath.split(os.sep)
-        while components and curdir_obj:
-            comp = components[0]
-            components = components[1:]
+        last_index = len(components) - 1
+        for index, comp in enumerate(components):
             if comp in (".", ""):
                 continue
-            if curdir_obj.is_dir() and not curdir_obj.was_scanned():
+            if not curdir_obj.was_scanned():
                 self.scan_dir(curdir_obj)
-            next_obj = curdir_obj.get_entry(comp)
-            if next_obj is None or next_obj.is_dir() or not components:
-                curdir_obj = next_obj
-            else:
-                curdir_obj = None
+            next_obj = curdir_obj.entries.get(comp)
+            if next_obj is None \
+                    or not (next_obj.is_dir() or index == last_index):
+                return None
+            curdir_obj = next_obj
         return curdir_obj
 
     def walk_dir_contents(self, subdir_path, dirs=False):
@@ -693,9 +706,10 @@ class FileTree:
 
         def output_files(dir_obj):
             dir_path = dir_obj.get_relpath()
+            prefix = dir_path + os.sep if dir_path else ""
             for basename, obj in dir_obj.entries.items():
                 if (files and obj.is_file()):
-                    yield obj, dir_obj, os.path.join(dir_path, basename)
+                    yield obj, dir_obj, prefix + basename
 
         def output_dir(dir_obj):
             if dirs and dir_obj != startdir_obj:
@@ -795,15 +809,38 @@ class FileTree:
         If self.writeback, OSError may be thrown if the dir cannot be removed.
         If the dir_obj is non-empty, also throw OSError.
         """
+        relpath = dir_obj.get_relpath()
+        self.rm_dir_check(dir_obj, relpath)
+        self.rm_dir_disk(relpath)
+        self.rm_dir_tree(dir_obj, relpath)
+
+    # rm_dir_writeback in steps, for callers removing many dirs: only
+    # rm_dir_disk may run on worker threads, and only while the tree is not
+    # being changed.
+
+    def rm_dir_check(self, dir_obj, relpath):
+        """
+        Raise OSError if dir_obj, at relpath, cannot be removed: it is
+        non-empty. dir_obj cannot be the root directory.
+        """
         assert dir_obj.parent, \
             "trying to remove rootdir,"
-        relpath = dir_obj.get_relpath()
         if dir_obj.entries:
             raise OSError("trying to remove non-empty dir: %s" % (relpath,))
+
+    def rm_dir_disk(self, relpath):
+        """
+        If self.writeback, remove the dir at relpath from disk, which may throw
+        OSError. Accesses no tree objects.
+        """
         if self.writeback:
             os.rmdir(self.rel_to_abs(relpath))
-        basename = os.path.basename(relpath)
-        dir_obj.parent.rm_entry(basename)
+
+    def rm_dir_tree(self, dir_obj, relpath):
+        """
+        Remove dir_obj, at relpath, from the tree only.
+        """
+        dir_obj.parent.rm_entry(os.path.basename(relpath))
 
     def _create_dir_if_needed_writeback(self, dir_relpath):
         """
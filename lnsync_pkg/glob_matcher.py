@@ -26,12 +26,14 @@ GlobMatcher - a set of patterns suited to match when traversing a tree
 
 # pylint: disable=invalid-name, protected-access, misplaced-comparison-constant
 
+import re
 import fnmatch
 
 import lnsync_pkg.printutils as pr
 
 _SEP = "/"
 _STST = "**"
+_WILDCARD_CHARS = frozenset("*?[")
 
 class Pattern:
     __slots__ = ("_inner_str", "_type",
@@ -96,6 +98,26 @@ class Pattern:
         """
         return self._sep_pos < 0 and fnmatch.fnmatch("", self._inner_str)
 
+    def literal_head(self):
+        """
+        If the first path component of the pattern has no wildcards, i.e. it
+        matches only one exact path component, return it. Else return None.
+        """
+        head = self._inner_str if self._sep_pos < 0 \
+               else self._inner_str[:self._sep_pos]
+        if not head or not _WILDCARD_CHARS.isdisjoint(head):
+            return None
+        return head
+
+    def basename_regex(self):
+        """
+        Return a regex string matching exactly the single path components we
+        match, or None if we can only match multi-component paths.
+        """
+        if self._sep_pos >= 0:
+            return None
+        return fnmatch.translate(self._inner_str)
+
     def head_to_tails(self, component):
         """
         Given a non-empty path component, return a list of new tail patterns
@@ -170,6 +192,17 @@ class Pattern:
                                 self._inner_str,
                                 "/" if self._dir_matcher else "")
 
+def compile_basename_matcher(patterns):
+    """
+    Return a compiled regex matching the single path components matched by
+    any of the patterns, or None if no pattern matches any.
+    """
+    regexes = [rgx for rgx in (p.basename_regex() for p in patterns)
+               if rgx is not None]
+    if not regexes:
+        return None
+    return re.compile("|".join("(?:%s)" % rgx for rgx in regexes))
+
 class ExcludePattern(Pattern):
     __slots__ = ()
     def __init__(self, path_glob):
@@ -29,6 +29,10 @@ or concatenated on a single line.
 import lnsync_pkg.printutils as pr
 from lnsync_pkg.human2bytes import bytes2human
 
+# Escape a few choice characters in sameline mode.
+_SAMELINE_ESCAPES = str.maketrans(
+    {char: "\\" + char for char in ("\\", " ", "'", '"', "(", ")")})
+
 
 class GroupedFileListPrinter:
     """
@@ -57,7 +61,7 @@ class GroupedFileListPrinter:
             self.groups = []
         self._output_group_linebreak = False # Not before first group.
         if self.sameline:
-            self._built_line = None
+            self._line_parts = None
 
     def add_group(self, located_files):
         """
@@ -85,7 +89,7 @@ class GroupedFileListPrinter:
 
     def _print_group(self, located_files):
         if self.sameline:
-            self._built_line = ""
+            self._line_parts = []
         else:
             if self._output_group_linebreak:
                 pr.print("")
@@ -95,7 +99,7 @@ class GroupedFileListPrinter:
             for fobj in fobjs:
                 self._print_file(tree, fobj)
         if self.sameline:
-            pr.print(self._built_line)
+            pr.print("".join(self._line_parts))
 
     def _print_file(self, tree, fobj):
         if self.showsize:
@@ -104,10 +108,11 @@ class GroupedFileListPrinter:
         else:
             size_str = ""
         if self.sameline:
-            if self._built_line != "":
-                self._built_line += " "
+            line_parts = self._line_parts
+            if line_parts:
+                line_parts.append(" ")
             else:
-                self._built_line = size_str + " "
+                line_parts.append(size_str + " ")
             for k, relpath in enumerate(fobj.relpaths):
                 if k == 0:
                     include, prefix = (True, "")
@@ -117,10 +122,8 @@ class GroupedFileListPrinter:
                     include = False
                 if include:
                     pr_path = tree.printable_path(relpath)
-                    # Escape a few choice characters.
-                    for char in ("\\", " ", "'", '"', "(", ")"):
-                        pr_path = pr_path.replace(char, "\\"+char)
-                    self._built_line += prefix + pr_path
+                    line_parts.append(
+                        prefix + pr_path.translate(_SAMELINE_ESCAPES))
         else:
             for k, relpath in enumerate(fobj.relpaths):
                 if k == 0:
@@ -363,6 +363,7 @@ class HasherManager:
     Global settings, for all module clients.
     """
     _hasher = None
+    _hash_depends_on_file_size = None
     _using_default = True
 
     @staticmethod
@@ -378,6 +379,13 @@ class HasherManager:
     def get_hasher():
         return HasherManager._hasher
 
+    @staticmethod
+    def hash_depends_on_file_size():
+        """
+        Cached from the current hasher when it is set.
+        """
+        return HasherManager._hash_depends_on_file_size
+
     @staticmethod
     def get_hasher_function_id():
         return HasherManager._hasher.get_hasher_function_id()
@@ -405,6 +413,8 @@ class HasherManager:
             if  old_algo != new_algo:
                 pr.warning(f"changing hasher from {old_algo} to {new_algo}")
         HasherManager._hasher = hasher
+        HasherManager._hash_depends_on_file_size = \
+            hasher.hash_depends_on_file_size()
 
 HasherManager.reset()
 
@@ -25,8 +25,11 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import abc
 import sys
 import os
+import io
+import stat
 import argparse
-from sqlite3 import Error as SQLError
+import functools
+import importlib
 
 import lnsync_pkg.metadata as metadata
 import lnsync_pkg.printutils as pr
@@ -39,12 +42,10 @@ from lnsync_pkg.hasher_functions import HasherManager, HasherFunctionID
 from lnsync_pkg.argparse_config import \
     ConfigError, NoSectionError, NoOptionError, NoValidConfigFile, \
     ArgumentParserConfig
-from lnsync_pkg.filehashtree import FileHashTree, TreeError, PropDBError
 from lnsync_pkg.lnsync_treeargs import TreeLocation, TreeLocationOnline, \
     TreeLocationAction, TreeOptionAction, ConfigTreeOptionAction, Scope
 from lnsync_pkg.prefixdbname import \
     get_default_dbprefix, adjust_default_dbprefix
-import lnsync_pkg.lnsync_cmd_handlers as lnsync_cmd_handlers
 from lnsync_pkg.groupedfileprinter import GroupedFileListPrinter
 
 ####################
@@ -55,6 +56,10 @@ LNSYNC_CONFIG_MAIN_SECTION = "LNSYNC_MAIN"
 
 _DEBUG_PARSER = False
 
+# Command handlers given by name are looked up in this module, which is
+# imported only when a command is actually dispatched.
+_CMD_HANDLERS_MODULE = "lnsync_pkg.lnsync_cmd_handlers"
+
 if False: # Set sys.excepthook handler to help debugging.
     set_exception_hook()
 
@@ -168,11 +173,14 @@ def valid_executable_str(path):
     Exclude non-executables.
     """
     #TODO: permissions.
-    import stat
     path = os.path.expanduser(path)
-    if not os.path.isfile(path):
+    try:
+        st_mode = os.stat(path).st_mode
+    except OSError:
+        st_mode = 0
+    if not stat.S_ISREG(st_mode):
         raise argparse.ArgumentTypeError("not a file: %s" % path)
-    elif not os.stat(path).st_mode & stat.S_IXUSR:
+    elif not st_mode & stat.S_IXUSR:
         raise argparse.ArgumentTypeError("not an executable: %s" % (path,))
     return path
 
@@ -308,6 +316,17 @@ dblocation_option_parser.add_argument(
 
 ## Include/exclude pattern options.
 
+# Pattern objects are immutable, so equal pattern strings may share a single
+# instance, even when the same defaults are applied to many trees.
+
+@functools.lru_cache(maxsize=None)
+def _make_include(pat_str):
+    return IncludePattern(pat_str)
+
+@functools.lru_cache(maxsize=None)
+def _make_exclude(pat_str):
+    return ExcludePattern(pat_str)
+
 class IncExcPatternOptionBase(ConfigTreeOptionAction):
     """
     Common to all include/exclude option Actions.
@@ -316,30 +335,32 @@ class IncExcPatternOptionBase(ConfigTreeOptionAction):
         """
         Transform a list of pattern strings into a list of pattern objects.
         """
-        object_type = self.which_pattern_obj(option_string)
-        return [object_type(p) for p in pattern_strings]
+        make_pattern = self.which_pattern_obj(option_string)
+        return [make_pattern(p) for p in pattern_strings]
 
     @staticmethod
     def which_pattern_obj(option_string):
         """
-        Return the correct type IncludePattern/ExcludePattern
+        Return the correct IncludePattern/ExcludePattern factory
         depending on the option string.
         """
         if "include" in option_string:
-            obj_type = IncludePattern
+            obj_maker = _make_include
         elif "exclude" in option_string:
-            obj_type = ExcludePattern
+            obj_maker = _make_exclude
         else:
             raise RuntimeError
-        return obj_type
+        return obj_maker
 
-    def get_from_tree_section(self, arg_tree, key, merge_sections, type=None):
+    def get_from_tree_section(self, arg_tree, key, merge_sections, type=None,
+                              comparator=None):
         """
         Convert exclude strings to exclude pattern objects.
         (This cannot be accomplished via the type, since the potion string is also needed.
         to distinguish between include and exclude patterns.)
         """
-        str_vals = super().get_from_tree_section(arg_tree, key, merge_sections, type)
+        str_vals = super().get_from_tree_section(
+            arg_tree, key, merge_sections, type, comparator=comparator)
         # key is the option string, stripped of leading hyphens.
         return self.make_pattern_obj_list(str_vals, key)
 
@@ -358,9 +379,9 @@ class IncOnlyPatternOption(IncExcPatternOptionBase):
         """
         Transform a list of pattern strings into a list of pattern objects.
         """
-        return [IncludePattern("*/")] + \
-               [IncludePattern(p) for p in pattern_strings] + \
-               [ExcludePattern("*")]
+        return [_make_include("*/")] + \
+               [_make_include(p) for p in pattern_strings] + \
+               [_make_exclude("*")]
 
 exclude_option_parser = argparse.ArgumentParser(add_help=False)
 
@@ -532,6 +553,8 @@ class CustomArgumentParserConfig(ArgumentParserConfig):
         """
         Register handler function and then add_parser to the command
         subparser handler.
+        handler_fn is either a function or the name of a function in the
+        command handlers module.
         """
         if not extra_args_cmd:
             self.cmd_handlers[name] = handler_fn
@@ -539,6 +562,17 @@ class CustomArgumentParserConfig(ArgumentParserConfig):
             self.cmd_handlers_extra_args[name] = handler_fn
         return self._cmd_subparser_handler.add_parser(name, **kwargs)
 
+    @staticmethod
+    def resolve_handler(handler_fn):
+        """
+        Return the handler function, importing the command handlers module
+        if the handler was registered by name.
+        """
+        if isinstance(handler_fn, str):
+            handlers_module = importlib.import_module(_CMD_HANDLERS_MODULE)
+            handler_fn = getattr(handlers_module, handler_fn)
+        return handler_fn
+
     def error(self, message):
         raise ArgumentParserError(message)
 
@@ -554,7 +588,7 @@ top_parser = CustomArgumentParserConfig(\
 ## sync
 
 parser_sync = top_parser.add_parser_command(
-    'sync', lnsync_cmd_handlers.do_sync,
+    'sync', "do_sync",
     parents=[dryrun_option_parser, exclude_option_parser,
              maxminsize_option_parser,
              bysize_option_parser, skipempty_option_parser,
@@ -571,7 +605,7 @@ parser_sync.add_argument(
 ## rsync
 
 parser_rsync = top_parser.add_parser_command(
-    'rsync', lnsync_cmd_handlers.do_rsync,
+    'rsync', "do_rsync",
     extra_args_cmd=True,
     parents=[dryrun_option_parser, exclude_option_parser,
              hard_links_option_parser,
@@ -592,9 +626,17 @@ parser_rsync.add_argument(
     "target", type=TreeLocationOnline, action=TreeLocationAction)
 
 def do_syncr(args, more_args):
+    import lnsync_pkg.lnsync_cmd_handlers as lnsync_cmd_handlers
     lnsync_cmd_handlers.do_sync(args)
     args.execute = True
-    lnsync_cmd_handlers.do_rsync(args, more_args)
+    if args.cmp and args.pipeline:
+        # rsync only reads the source, so its hashes, needed by cmp, can be
+        # computed while the transfer runs.
+        def while_running_fn():
+            lnsync_cmd_handlers.do_update_hashes(args.source)
+    else:
+        while_running_fn = None
+    lnsync_cmd_handlers.do_rsync(args, more_args, while_running_fn)
     if args.cmp:
         args.leftlocation = args.source
         args.rightlocation = args.target
@@ -620,6 +662,11 @@ parser_syncr.add_argument(
     "--cmp", default=False, action="store_true",
     help="compare source and target after rsync")
 
+parser_syncr.add_argument(
+    "--pipeline", default=False, action="store_true",
+    help="with --cmp, hash source files while rsync is running; "
+         "does nothing without --cmp")
+
 ## Search commands
 
 _SEARCH_CMD_PARENTS = \
@@ -633,7 +680,7 @@ _SEARCH_CMD_PARENTS = \
 # fdupes
 
 parser_fdupes = top_parser.add_parser_command(
-    'fdupes', lnsync_cmd_handlers.do_fdupes,
+    'fdupes', "do_fdupes",
     parents=_SEARCH_CMD_PARENTS,
     help='find duplicate files')
 
@@ -643,7 +690,7 @@ parser_fdupes.add_argument(
 # onall
 
 parser_onall = top_parser.add_parser_command(
-    'onall', lnsync_cmd_handlers.do_onall,
+    'onall', "do_onall",
     parents=_SEARCH_CMD_PARENTS,
     help='find files common to all trees')
 
@@ -653,7 +700,7 @@ parser_onall.add_argument(
 # onfirstonly
 
 parser_onfirstonly = top_parser.add_parser_command(
-    'onfirstonly', lnsync_cmd_handlers.do_onfirstonly,
+    'onfirstonly', "do_onfirstonly",
     parents=_SEARCH_CMD_PARENTS,
     help='find files on first tree and not on any other (content only)')
 
@@ -663,7 +710,7 @@ parser_onfirstonly.add_argument(
 # onlastonly
 
 parser_onlastonly = top_parser.add_parser_command(
-    'onlastonly', lnsync_cmd_handlers.do_onlastonly,
+    'onlastonly', "do_onlastonly",
     parents=_SEARCH_CMD_PARENTS,
     help='find files on last tree and not on any other (content only)')
 
@@ -673,7 +720,7 @@ parser_onlastonly.add_argument(
 # onfirstnotonly
 
 parser_onfirstnotonly = top_parser.add_parser_command(
-    'onfirstnotonly', lnsync_cmd_handlers.do_onfirstnotonly,
+    'onfirstnotonly', "do_onfirstnotonly",
     parents=_SEARCH_CMD_PARENTS,
     help='find files on first tree and also on some other (content only)')
 
@@ -683,7 +730,7 @@ parser_onfirstnotonly.add_argument(
 # onlastnotonly
 
 parser_onlastnotonly = top_parser.add_parser_command(
-    'onlastnotonly', lnsync_cmd_handlers.do_onlastnotonly,
+    'onlastnotonly', "do_onlastnotonly",
     parents=_SEARCH_CMD_PARENTS,
     help='find files on last tree but also on some other (content only)')
 
@@ -693,7 +740,7 @@ parser_onlastnotonly.add_argument(
 # onmorethanone
 
 parser_onmorethanone = top_parser.add_parser_command(
-    'onmorethanone', lnsync_cmd_handlers.do_onmorethanone,
+    'onmorethanone', "do_onmorethanone",
     parents=_SEARCH_CMD_PARENTS,
     help='find files on at least two trees (content only)')
 
@@ -703,7 +750,7 @@ parser_onmorethanone.add_argument(
 # search
 
 parser_search = top_parser.add_parser_command(
-    'search', lnsync_cmd_handlers.do_search,
+    'search', "do_search",
     parents=_SEARCH_CMD_PARENTS,
     help="Search for files by relative path glob pattern")
 
@@ -716,6 +763,7 @@ parser_search.add_argument(
 ## update
 
 def do_update(args):
+    from lnsync_pkg.filehashtree import FileHashTree
     with FileHashTree.listof(d.kws() for d in args.dirs) as trees:
         for tree in trees:
             tree.db_update_all()
@@ -733,6 +781,7 @@ parser_update.add_argument(
 ## rehash
 
 def do_rehash(args):
+    import lnsync_pkg.lnsync_cmd_handlers as lnsync_cmd_handlers
     return lnsync_cmd_handlers.do_rehash(args.topdir, args.relpath_patterns)
 
 parser_rehash = top_parser.add_parser_command(
@@ -748,7 +797,7 @@ parser_rehash.add_argument("relpath_patterns", type=relative_path_type, nargs='+
 ## lookup
 
 parser_lookup = top_parser.add_parser_command(
-        'lookup', lnsync_cmd_handlers.do_lookup,
+        'lookup', "do_lookup",
         parents=[dbrootdir_option_parser,
                  dblocation_option_parser,
                  ],
@@ -762,7 +811,7 @@ parser_lookup.add_argument("relpaths", type=relative_path_type, nargs="*")
 ## aliases
 
 parser_aliases = top_parser.add_parser_command(
-        'aliases', lnsync_cmd_handlers.do_aliases,
+        'aliases', "do_aliases",
         parents=[dbrootdir_option_parser,
                  dblocation_option_parser,
                 ],
@@ -776,7 +825,7 @@ parser_aliases.add_argument("relpath", type=relative_path_type)
 ## cmp
 
 parser_cmp = top_parser.add_parser_command(
-    'cmp', lnsync_cmd_handlers.do_cmp,
+    'cmp', "do_cmp",
     parents=[exclude_all_options_parser,
              hard_links_option_parser, bysize_option_parser,
              maxminsize_option_parser, skipempty_option_parser,
@@ -793,7 +842,7 @@ parser_cmp.add_argument(
 ## check
 
 parser_check_files = top_parser.add_parser_command(
-    'check', lnsync_cmd_handlers.do_check,
+    'check', "do_check",
     parents=[exclude_all_options_parser,
              hard_links_option_parser,
              maxminsize_option_parser, skipempty_option_parser,
@@ -812,6 +861,7 @@ parser_check_files.add_argument(
 ## info
 
 def do_get_info(args):
+    from lnsync_pkg.filehashtree import FileHashTree
     for tree_arg in args.locations:
         with FileHashTree(**tree_arg.kws()) as tree:
             if tree.mode == Mode.ONLINE:
@@ -845,7 +895,7 @@ parser_get_info.add_argument(
 ## subdir
 
 parser_subdir = top_parser.add_parser_command(
-        'subdir', lnsync_cmd_handlers.do_subdir,
+        'subdir', "do_subdir",
         parents=[dblocation_option_parser,
                 ],
         help='copy hashes to new database at relative subdir')
@@ -880,7 +930,7 @@ def writable_file_or_empty_path(path):
     return path
 
 parser_mkoffline = top_parser.add_parser_command(
-    'mkoffline', lnsync_cmd_handlers.do_mkoffline,
+    'mkoffline', "do_mkoffline",
     parents=[exclude_all_options_parser, maxminsize_option_parser,
              skipempty_option_parser,
              dbrootdir_option_parser, dblocation_option_parser,
@@ -901,7 +951,7 @@ parser_mkoffline.add_argument(
 ## cleandb
 
 parser_cleandb = top_parser.add_parser_command(
-        'cleandb', lnsync_cmd_handlers.do_cleandb,
+        'cleandb', "do_cleandb",
         parents=[dblocation_option_parser,
                 ],
         help="purge old entries and compact the hash database at dir")
@@ -921,17 +971,20 @@ def debug_tree_info(args):
         if "exclude_patterns" in tr.kws:
             tr.kws["exclude_patterns"] = \
                 list(map(str, tr.kws["exclude_patterns"]))
+    buf = io.StringIO()
     for t in xargs:
         if isinstance(xargs[t], TreeLocation):
             excstr(xargs[t])
-            print("%s -> %s\n" % (t, xargs[t].kws))
+            buf.write(f"{t} -> {xargs[t].kws}\n\n")
         elif isinstance(xargs[t], list) \
                 and all(isinstance(x, TreeLocation) for x in xargs[t]):
-            print("%s -> [" % (t))
+            buf.write(f"{t} -> [\n")
             for k, _x in enumerate(xargs[t]):
                 excstr(xargs[t][k])
-                print(" [%s] -> %s" % (k, xargs[t][k].kws))
-            print("    ]\n")
+                buf.write(f" [{k}] -> {xargs[t][k].kws}\n")
+            buf.write("    ]\n\n")
+    sys.stdout.write(buf.getvalue())
+    sys.stdout.flush()
 
 def get_handler_fn(cmd_line_args):
     """
@@ -942,18 +995,20 @@ def get_handler_fn(cmd_line_args):
     """
     try:
         args, extra_args = top_parser.parse_known_args(cmd_line_args)
+        TreeLocationAction.check_duplicates(args)
         cmd = args.cmdname
     except ValueError as exc:
         raise ConfigError("bad argument: %s" % str(exc)) from exc
     if _DEBUG_PARSER:
         handler_fn = lambda: (args, extra_args)
     elif cmd in top_parser.cmd_handlers:
+        cmd_fn = top_parser.resolve_handler(top_parser.cmd_handlers[cmd])
         if not extra_args:
-            handler_fn = lambda: top_parser.cmd_handlers[cmd](args)
+            handler_fn = lambda: cmd_fn(args)
         else: # If the extra arguments are erroneous, let argparse explain why.
             args = top_parser.parse_args()
             pr.warning("discarded arguments: "+ " ".join(extra_args))
-            handler_fn = lambda: top_parser.cmd_handlers[cmd](args)
+            handler_fn = lambda: cmd_fn(args)
     elif cmd in top_parser.cmd_handlers_extra_args:
         if extra_args and extra_args != cmd_line_args[-len(extra_args):]:
             # Extra args found not only at the end of the argument list.
@@ -962,8 +1017,9 @@ def get_handler_fn(cmd_line_args):
             raise ArgumentParserError("Unexpected arguments: " + extra_args)
         if extra_args and extra_args[0] == '--': # Strip away this delimiter.
             extra_args == extra_args[1:]
-        handler_fn = lambda: \
-            top_parser.cmd_handlers_extra_args[cmd](args, extra_args)
+        cmd_fn = top_parser.resolve_handler(
+            top_parser.cmd_handlers_extra_args[cmd])
+        handler_fn = lambda: cmd_fn(args, extra_args)
     else:
         assert cmd is None, "get_handler_fn: expected None here"
         pr.error("no command")
@@ -996,6 +1052,9 @@ def main():
         top_parser.print_help(sys.stderr)
         sys.exit(64)
     pr.set_app_prefix("lnsync:")
+    # Imported here, so that usage and help output need not load them.
+    from sqlite3 import Error as SQLError
+    from lnsync_pkg.filehashtree import TreeError, PropDBError
     try:
         exit_code = 2
         cmd_handler = get_handler_fn(sys.argv[1:])
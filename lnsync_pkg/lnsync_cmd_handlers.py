@@ -10,6 +10,9 @@ Command handlers do_sync, do_rsync, do_search, do_cmp, do_check
 # pylint: disable=too-many-nested-blocks, too-many-statements
 
 import os
+import functools
+import collections
+import concurrent.futures
 import subprocess
 import shlex
 import shutil
@@ -17,7 +20,8 @@ import tempfile
 
 from lnsync_pkg.sqlpropdb import SQLPropDBManager
 import lnsync_pkg.printutils as pr
-from lnsync_pkg.miscutils import is_subdir, iter_is_empty, HelperAppError
+from lnsync_pkg.miscutils import is_subdir_fast, iter_is_empty, \
+    HelperAppError
 from lnsync_pkg.human2bytes import bytes2human
 import lnsync_pkg.fdupes as fdupes
 from lnsync_pkg.prefixdbname import pick_db_basename, get_default_dbprefix
@@ -27,11 +31,70 @@ from lnsync_pkg.matcher import TreePairMatcher
 from lnsync_pkg.filehashtree import \
     FileHashTree, TreeError, TreeNoPropValueError, PropDBException
 from lnsync_pkg.lnsync_treeargs import TreeLocation, TreeLocationOnline
+from lnsync_pkg.glob_matcher import compile_basename_matcher
 from lnsync_pkg.modaltype import Mode
 from lnsync_pkg.hasher_functions import HasherManager
 
+# The same relpaths are often quoted repeatedly, e.g. as sources of several
+# sync commands, so keep the quoted strings around.
+_quote_path = functools.lru_cache(maxsize=65536)(shlex.quote)
+
 def hash_depends_on_file_size():
-    return HasherManager.get_hasher().hash_depends_on_file_size()
+    return HasherManager.hash_depends_on_file_size()
+
+# Threads issuing rmdir calls for the dirs of one level in sync.
+_RMDIR_WORKERS = 8
+
+# How many files ahead of the one being hashed to ask the kernel to read.
+_READAHEAD_DEPTH = 8
+
+def _advise_willneed(abspath):
+    """
+    Ask the kernel to start reading a file into the page cache, if possible.
+    """
+    try:
+        fd = os.open(abspath, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _gen_with_readahead(tree, objs_paths, depth=_READAHEAD_DEPTH):
+    """
+    Yield the (obj, relpath) pairs, having requested readahead for those up
+    to depth positions later, so that disk reads overlap hashing.
+    Readahead is requested only for tree file objects, once per object, so
+    no file is opened that will not be hashed.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        yield from objs_paths
+        return
+    pending = collections.deque()
+    objs_advised = set()
+    for obj_path in objs_paths:
+        obj = obj_path[0]
+        if obj is not None and obj.is_file() and obj not in objs_advised:
+            # Use the object's own path: a given relpath may lead
+            # outside the tree.
+            objs_advised.add(obj)
+            _advise_willneed(tree.rel_to_abs(obj.relpaths[0]))
+        pending.append(obj_path)
+        if len(pending) > depth:
+            yield pending.popleft()
+    yield from pending
+
+def do_update_hashes(location_arg):
+    """
+    Bring the hash database of an online tree up to date.
+    """
+    if location_arg.mode != Mode.ONLINE:
+        return
+    with FileHashTree(**location_arg.kws()) as tree:
+        tree.db_update_all()
 
 def do_rehash(location_arg, relpaths):
     error_found = False
@@ -49,14 +112,16 @@ def do_rehash(location_arg, relpaths):
     with FileHashTree(**location_arg.kws()) as tree:
         for relpath in relpaths:
             tree_obj = tree.path_to_obj(relpath)
-            pr_path = tree.printable_path(relpath, pprint=shlex.quote)
+            pr_path = tree.printable_path(relpath, pprint=_quote_path)
             if tree_obj is None:
                 pr.error(f"not found:{pr_path}")
                 error_found = True
             elif tree_obj.is_file():
                 rehash_one_file(tree, pr_path, tree_obj)
             elif tree_obj.is_dir():
-                for file_obj in tree.walk_files(tree_obj):
+                files_paths = ((file_obj, file_obj.relpaths[0])
+                               for file_obj in tree.walk_files(tree_obj))
+                for file_obj, _path in _gen_with_readahead(tree, files_paths):
                     rehash_one_file(tree, pr_path, file_obj)
             else:
                 pr.error(f"not a file or dir:{pr_path}")
@@ -71,7 +136,7 @@ def do_lookup(args):
     with FileHashTree(**location_arg.kws()) as tree:
         for relpath in relpaths:
             file_obj = tree.path_to_obj(relpath)
-            fname = tree.printable_path(relpath, pprint=shlex.quote)
+            fname = tree.printable_path(relpath, pprint=_quote_path)
             if file_obj is None:
                 pr.error(f"not found:{fname}")
                 error_found = True
@@ -97,8 +162,8 @@ def do_sync(args):
                 raise NotImplementedError("match failed")
             tgt_tree.writeback = not args.dry_run
             for cmd in matcher.generate_sync_cmds():
-                cmd_str = \
-                    cmd[0] + " " + " ".join(shlex.quote(arg) for arg in cmd[1:])
+                cmd_str = cmd[0] + " " \
+                    + " ".join(_quote_path(arg) for arg in cmd[1:])
                 pr.print(cmd_str)
                 try:
                     tgt_tree.exec_cmd(cmd)
@@ -112,40 +177,72 @@ def do_sync(args):
                     in tgt_tree.walk_paths(
                             recurse=True, topdown=False,
                             dirs=True, files=False):
-                if all((obj.is_dir() and obj in dirs_to_rm_set) \
+                # Test the cheap condition first: a dir can only go if all
+                # its entries are dirs that go too.
+                if all((obj in dirs_to_rm_set) \
                        for obj in dir_obj.entries.values()):
                     if src_tree.path_to_obj(relpath) is None:
                         dirs_to_rm_set.add(dir_obj)
-                        dirs_to_rm_list.append(dir_obj)
-            err_dir_relpaths = set()
-            for dobj in dirs_to_rm_list:
-                relpath = dobj.get_relpath()
-                pr.print("rmdir " + shlex.quote(relpath))
-                # Next follows tgt_tree.writeback.
+                        dirs_to_rm_list.append((dir_obj, relpath))
+            if not dirs_to_rm_list:
+                pr.debug("sync done")
+                return
+            def rm_dir_disk(relpath):
+                # Only the disk step runs on worker threads: the tree itself
+                # is only changed on this thread.
                 try:
-                    tgt_tree.rm_dir_writeback(dobj)
+                    tgt_tree.rm_dir_disk(relpath)
                 except OSError as exc:
-                    if not any(is_subdir(err_dir, relpath) \
-                               for err_dir in err_dir_relpaths):
-                        pr.info(str(exc))
-                        err_dir_relpaths.add(dobj)
+                    return exc
+                return None
+            # Dirs at the same depth are independent, so remove each level
+            # in parallel, deepest first, when writing to disk.
+            dirs_by_depth = collections.defaultdict(list)
+            for dobj, relpath in dirs_to_rm_list:
+                dirs_by_depth[relpath.count(os.sep)].append((dobj, relpath))
+            err_dir_relpaths = set()
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=_RMDIR_WORKERS) as executor:
+                for depth in sorted(dirs_by_depth, reverse=True):
+                    level = dirs_by_depth[depth]
+                    use_pool = tgt_tree.writeback and len(level) > 1
+                    results = [] # Per dir, an exception, a future, or None.
+                    for dobj, relpath in level:
+                        pr.print("rmdir " + _quote_path(relpath))
+                        try:
+                            tgt_tree.rm_dir_check(dobj, relpath)
+                        except OSError as exc:
+                            results.append(exc)
+                        else:
+                            if use_pool:
+                                results.append(
+                                    executor.submit(rm_dir_disk, relpath))
+                            else:
+                                results.append(rm_dir_disk(relpath))
+                    for (dobj, relpath), exc in zip(level, results):
+                        if isinstance(exc, concurrent.futures.Future):
+                            exc = exc.result()
+                        if exc is None:
+                            tgt_tree.rm_dir_tree(dobj, relpath)
+                        elif not any(is_subdir_fast(err_dir, relpath) \
+                                     for err_dir in err_dir_relpaths):
+                            pr.info(str(exc))
+                            err_dir_relpaths.add(relpath)
             pr.debug("sync done")
 
-def do_rsync(args, rsync_args):
+def do_rsync(args, rsync_args, while_running_fn=None):
     """
     Print (and optionally execute) a suitable rsync command.
     args.source and args.target are TreeLocation objects,
     with gathered command-line options in the namespace attribute.
+    If given, while_running_fn is called without arguments while rsync
+    executes.
     """
     src_dir = args.source.real_location
     tgt_dir = args.target.real_location
     if src_dir[-1] != os.sep:
         src_dir += os.sep # rsync needs trailing / on sourcedir.
-
-# Use subprocess.run with shell=True to display the generated rsync command.
-    src_dir = shlex.quote(src_dir)
-    tgt_dir = shlex.quote(tgt_dir)
-    while tgt_dir[-1] == os.sep:
+    while len(tgt_dir) > 1 and tgt_dir[-1] == os.sep:
         tgt_dir = tgt_dir[:-1]
 
     # Options for rsync: recursive.
@@ -163,18 +260,27 @@ def do_rsync(args, rsync_args):
     TreeLocation.merge_patterns(args.source, args.target)
     for pat in getattr(args.source.namespace, "exclude_patterns", []):
         cmd_pattern = pat.to_str()
-        vals = ("exclude" if pat.is_exclude() else "include",
-                shlex.quote(cmd_pattern))
+        vals = ("exclude" if pat.is_exclude() else "include", cmd_pattern)
         rsync_opts.append('--%s=%s' % vals)
 
-    rsync_cmd = ["rsync"] + rsync_opts + rsync_args + [src_dir, tgt_dir]
-    rsync_cmd = " ".join(rsync_cmd)
+    # Run rsync directly, without a shell; quote only for display.
+    rsync_argv = ["rsync"] + rsync_opts + rsync_args + [src_dir, tgt_dir]
+    rsync_cmd = " ".join(shlex.quote(arg) for arg in rsync_argv)
     pr.print(rsync_cmd)
 
     if args.execute:
         try:
-            subprocess.run(rsync_cmd, check=True, shell=True)
-        except subprocess.SubprocessError as exc:
+            rsync_proc = subprocess.Popen(rsync_argv)
+        except (OSError, subprocess.SubprocessError) as exc:
+            raise HelperAppError(rsync_cmd, str(exc)) from exc
+        # Exceptions from while_running_fn are not rsync's: let them
+        # through, once rsync has exited.
+        with rsync_proc:
+            if while_running_fn is not None:
+                while_running_fn()
+        if rsync_proc.returncode:
+            exc = subprocess.CalledProcessError(
+                rsync_proc.returncode, rsync_cmd)
             raise HelperAppError(rsync_cmd, str(exc)) from exc
 
 def do_search(args):
@@ -192,15 +298,17 @@ def do_search(args):
     def print_file_match(tree, fobj):
         if args.showsize:
             pr.print(bytes2human(fobj.file_metadata.size), end=" ")
-        pr.print(tree.printable_path(files_paths_matched[fobj][0]))
-        for fpath in files_paths_matched[fobj][1:]:
+        paths_matched = files_paths_matched[fobj]
+        pr.print(tree.printable_path(paths_matched[0]))
+        for fpath in paths_matched[1:]:
             pr.print(" " + tree.printable_path(fpath))
         if args.all_links:
+            paths_matched = set(paths_matched)
             for fpath in fobj.relpaths:
-                if fpath not in files_paths_matched[fobj]:
+                if fpath not in paths_matched:
                     pr.print(" " + tree.printable_path(fpath))
 
-    def print_file_match_simple(tree, fobj, path):
+    def print_file_match_simple(tree, fobj):
         """ Print just the first path.
         """
         if args.showsize:
@@ -215,14 +323,16 @@ def do_search(args):
             return
         tree.scan_dir(dir_obj)
         patterns = set(patterns)
+        dir_relpath = dir_obj.get_relpath()
+        path_prefix = dir_relpath + os.sep if dir_relpath else ""
 
         def handle_file_match(obj, basename):
-            path = os.path.join(dir_obj.get_relpath(), basename)
+            path = path_prefix + basename
             if not args.hard_links or len(obj.relpaths) == 1:
                 print_file_match_simple(tree, obj)
             else:
                 if obj not in files_paths_to_check:
-                    files_paths_to_check[obj] = list(obj.relpaths)
+                    files_paths_to_check[obj] = set(obj.relpaths)
                     files_paths_matched[obj] = []
                 assert path in files_paths_to_check[obj], \
                     "handle_file_match: path not in paths to check"
@@ -233,17 +343,41 @@ def do_search(args):
                     del files_paths_to_check[obj]
                     del files_paths_matched[obj]
 
-        for basename, obj in dir_obj.entries.items():
+        # Patterns with a literal head can only match entries of that name.
+        literal_patterns = {}
+        wildcard_patterns = []
+        for pat in patterns:
+            head = pat.literal_head()
+            if head is None:
+                wildcard_patterns.append(pat)
+            else:
+                literal_patterns.setdefault(head, []).append(pat)
+        wildcard_file_matcher = compile_basename_matcher(wildcard_patterns)
+        unanchored_patterns = [p for p in patterns if not p.is_anchored()]
+        entries = dir_obj.entries
+        if wildcard_patterns or unanchored_patterns:
+            entries_to_visit = entries.items()
+        else:
+            entries_to_visit = \
+                [(bname, entries[bname])
+                 for bname in literal_patterns if bname in entries]
+
+        for basename, obj in entries_to_visit:
+            if basename in literal_patterns:
+                candidate_patterns = \
+                    literal_patterns[basename] + wildcard_patterns
+            else:
+                candidate_patterns = wildcard_patterns
             if obj.is_file():
-                for pat in patterns:
-                    if pat.matches_exactly(basename):
-                        return_code = 0
-                        handle_file_match(obj, basename)
-                    break
+                if any(pat.matches_exactly(basename)
+                       for pat in literal_patterns.get(basename, ())) \
+                        or (wildcard_file_matcher is not None
+                            and wildcard_file_matcher.match(basename)):
+                    return_code = 0
+                    handle_file_match(obj, basename)
             if obj.is_dir():
-                subdir_patterns = \
-                    [p for p in patterns if not p.is_anchored()]
-                for pat in patterns:
+                subdir_patterns = list(unanchored_patterns)
+                for pat in candidate_patterns:
                     for tail_pat in pat.head_to_tails(basename):
                         if not tail_pat.is_empty():
                             subdir_patterns.append(tail_pat)
@@ -283,6 +417,10 @@ def do_search(args):
                 search_fast_offline_tree(tree, args.glob)
             else:
                 if args.hard_links:
+                    # Matches are grouped by file, and a file is printed
+                    # once all its relpaths are matched or not, so all
+                    # links must be known upfront. Without hard_links,
+                    # search_dir scans lazily, one directory at a time.
                     tree.scan_subtree()
                 search_dir(tree, tree.rootdir_obj, [args.glob])
             if args.hard_links:
@@ -311,7 +449,7 @@ def do_cmp(args):
             right_prop = right_tree.get_prop(right_obj)
         except TreeNoPropValueError as exc:
             if exc.first_try:
-                exc.pprint = shlex.quote
+                exc.pprint = _quote_path
                 pr.error(f"reading, ignoring: {str(exc)}")
             return_code = 1
         else:
@@ -324,12 +462,12 @@ def do_cmp(args):
                         == len(right_obj.relpaths) == 1):
                     pr.debug("files equal: %s", path)
                 else:
-                    left_links = list(left_obj.relpaths)
-                    right_links = list(right_obj.relpaths)
-                    for left_link in left_obj.relpaths:
-                        if left_link in right_links:
-                            left_links.remove(left_link)
-                            right_links.remove(left_link)
+                    left_links_set = set(left_obj.relpaths)
+                    right_links_set = set(right_obj.relpaths)
+                    left_links = [lnk for lnk in left_obj.relpaths
+                                  if lnk not in right_links_set]
+                    right_links = [lnk for lnk in right_obj.relpaths
+                                   if lnk not in left_links_set]
                     if not left_links and not right_links:
                         pr.debug("files equal: %s", path)
                     else:
@@ -340,70 +478,77 @@ def do_cmp(args):
                             pr.print(" right only link:", lnk)
                         return_code = 1
 
-    def cmp_subdir(dirpaths_to_visit, cur_dirpath):
-        for left_obj, basename in \
-                left_tree.walk_dir_contents(cur_dirpath, dirs=True):
-            left_path = os.path.join(cur_dirpath, basename)
-            right_obj = right_tree.path_to_obj(left_path)
-            if right_obj is None or right_obj.is_excluded():
-                if left_obj.is_file():
-                    pr.print("left only: " + left_path)
-                elif left_obj.is_dir():
-                    pr.print("left only: " + left_path+os.path.sep)
-                else:
-                    raise RuntimeError("unexpected left object: " + left_path)
-            elif left_obj.is_file():
-                if  right_obj.is_file():
-                    cmp_files(left_path, left_obj, right_obj)
-                elif right_obj.is_dir():
-                    pr.print("left file vs right dir: " + left_path)
+    def cmp_subdir(dirs_to_visit, cur_dirpath, left_dir, right_dir):
+        left_tree.scan_dir(left_dir)
+        right_tree.scan_dir(right_dir)
+        left_entries = left_dir.entries
+        right_entries = right_dir.entries
+        path_prefix = cur_dirpath + os.sep if cur_dirpath else ""
+        # Bind names used per entry to locals.
+        get_left, get_right = left_entries.get, right_entries.get
+        pr_print, sep = pr.print, os.path.sep
+        # Visit each basename once, left entries first.
+        for basename in {**left_entries, **right_entries}:
+            path = path_prefix + basename
+            left_obj = get_left(basename)
+            right_obj = get_right(basename)
+            if left_obj is not None and left_obj.is_excluded():
+                left_obj = None
+            if right_obj is not None and right_obj.is_excluded():
+                right_obj = None
+            if left_obj is not None \
+                    and (left_obj.is_file() or left_obj.is_dir()):
+                if right_obj is None:
+                    if left_obj.is_file():
+                        pr_print("left only: " + path)
+                    else:
+                        pr_print("left only: " + path + sep)
+                elif left_obj.is_file():
+                    if right_obj.is_file():
+                        cmp_files(path, left_obj, right_obj)
+                    elif right_obj.is_dir():
+                        pr_print("left file vs right dir: " + path)
+                    else:
+                        pr_print("left file vs other: " + path)
                 else:
-                    pr.print("left file vs other: " + left_path)
-            elif left_obj.is_dir():
-                if right_obj.is_dir():
-                    dirpaths_to_visit.append(left_path)
+                    if right_obj.is_dir():
+                        dirs_to_visit.append((path, left_obj, right_obj))
+                    elif right_obj.is_file():
+                        pr_print("left dir vs right file: " + path)
+                    else:
+                        pr_print("left dir vs other: " + path + sep)
+            elif right_obj is not None \
+                    and (right_obj.is_file() or right_obj.is_dir()):
+                if left_obj is None:
+                    if right_obj.is_file():
+                        pr_print("right only: " + path)
+                    else:
+                        pr_print("right only: " + path + sep)
                 elif right_obj.is_file():
-                    pr.print("left dir vs right file: " + left_path)
-                else:
-                    pr.print("left dir vs other: " + left_path + os.path.sep)
-            else:
-                raise RuntimeError("unexpected left object: " + left_path)
-        for right_obj, basename in \
-                right_tree.walk_dir_contents(cur_dirpath, dirs=True):
-            right_path = os.path.join(cur_dirpath, basename)
-            left_obj = left_tree.path_to_obj(right_path)
-            if left_obj is None or left_obj.is_excluded():
-                if right_obj.is_file():
-                    pr.print("right only: " + right_path)
-                elif right_obj.is_dir():
-                    pr.print("right only: " + right_path+os.path.sep)
+                    pr_print("left other vs right file: " + path)
                 else:
-                    raise RuntimeError(
-                        "unexpected right object: " + right_path)
-            elif right_obj.is_file():
-                if not left_obj.is_file() and not left_obj.is_dir():
-                    pr.print("left other vs right file: " + right_path)
-            elif right_obj.is_dir():
-                if not left_obj.is_file() and not left_obj.is_dir():
-                    pr.print("left other vs right dir: " + right_path)
-            else:
-                raise RuntimeError("unexpected right object: {right_path}")
+                    pr_print("left other vs right dir: " + path)
 
     with FileHashTree(**args.leftlocation.kws()) as left_tree:
         with FileHashTree(**args.rightlocation.kws()) as right_tree:
             if args.hard_links:
                 FileHashTree.scan_all_trees_async([left_tree, right_tree])
-            dirpaths_to_visit = [""]
-            while dirpaths_to_visit:
-                cur_dirpath = dirpaths_to_visit.pop()
-                cmp_subdir(dirpaths_to_visit, cur_dirpath)
+            dirs_to_visit = \
+                [("", left_tree.rootdir_obj, right_tree.rootdir_obj)]
+            while dirs_to_visit:
+                cur_dirpath, left_dir, right_dir = dirs_to_visit.pop()
+                cmp_subdir(dirs_to_visit, cur_dirpath, left_dir, right_dir)
     return return_code
 
 def do_check(args):
     def gen_all_paths(tree):
-        for _obj, _parent, path in \
+        for obj, _parent, path in \
                 tree.walk_paths(files=True, dirs=False, recurse=True):
-            yield path
+            yield obj, path
+
+    def gen_given_paths(tree, relpaths):
+        for path in relpaths:
+            yield tree.path_to_obj(path), path
     with FileHashTree(**args.location.kws()) as tree:
         assert tree.db.mode == Mode.ONLINE, \
             "do_check tree not online"
@@ -414,7 +559,7 @@ def do_check(args):
         else: # We're iterating over file objects in the tree, not paths.
             num_items = len(args.relpaths)
             items_are_paths = True
-            paths_gen = args.relpaths
+            paths_gen = gen_given_paths(tree, args.relpaths)
 
         def print_report():
             """
@@ -466,10 +611,12 @@ def do_check(args):
         files_error = 0
         try:
             index = 1
-            for path in paths_gen:
-                fobj = tree.path_to_obj(path)
-                if fobj in file_objs_checked_ok \
-                   or fobj in file_objs_checked_bad:
+            for fobj, path in _gen_with_readahead(tree, paths_gen):
+                # When walking the tree, a file is seen again only through
+                # another hard link.
+                if (items_are_paths or len(fobj.relpaths) > 1) \
+                   and (fobj in file_objs_checked_ok
+                        or fobj in file_objs_checked_bad):
                     if items_are_paths:
                         index += 1
                     continue
@@ -572,11 +719,15 @@ def do_onfirstonly(args):
             first_tree = all_trees[0]
             other_trees = all_trees[1:]
             first_tree.scan_subtree()
+            other_sizes = set().union(
+                *(tr.get_possible_sizes() for tr in other_trees))
             for file_sz in sorted(first_tree.get_possible_sizes()):
                 with pr.ProgressPrefix("size %s:" % (bytes2human(file_sz),)):
-                    if all(iter_is_empty(tr.size_to_files_gen(file_sz)) \
-                               for tr in other_trees):
+                    if file_sz not in other_sizes \
+                            or all(iter_is_empty(tr.size_to_files_gen(file_sz))
+                                   for tr in other_trees):
                         for fobj in first_tree.size_to_files_gen(file_sz):
+                            return_code = 0
                             grouper.add_group({first_tree: [fobj]})
                         continue
                     for _hash, located_files in \
@@ -605,7 +756,11 @@ def do_onfirstnotonly(args):
             FileHashTree.scan_online_trees_async(all_trees)
             first_tree = all_trees[0]
             other_trees = all_trees[1:]
-            for file_sz in sorted(first_tree.get_possible_sizes()):
+            other_sizes = set().union(
+                *(tr.get_possible_sizes() for tr in other_trees))
+            candidate_sizes = \
+                set(first_tree.get_possible_sizes()) & other_sizes
+            for file_sz in sorted(candidate_sizes):
                 with pr.ProgressPrefix("size %s:" % (bytes2human(file_sz),)):
                     if all(iter_is_empty(tr.size_to_files_gen(file_sz)) \
                            for tr in other_trees):
@@ -39,29 +39,162 @@ config file for values for the option.)
 # pylint: disable=no-member, redefined-builtin, unused-import
 
 import os
+import stat
 import argparse
+import functools
 
 import lnsync_pkg.printutils as pr
 from lnsync_pkg.glob_matcher import Pattern, ExcludePattern, merge_pattern_lists
-from lnsync_pkg.miscutils import is_subdir, append_to_namespace_list
+from lnsync_pkg.miscutils import append_to_namespace_list
 from lnsync_pkg.modaltype import Mode
 from lnsync_pkg.argparse_scoped import ScOptArgAction, ScPosArgAction, Scope
 from lnsync_pkg.prefixdbname import mode_from_location, pick_db_basename
 from lnsync_pkg.argparse_config import NoSectionError, NoOptionError, \
     ArgumentParserConfig, ConfigError
 
+# Absolute, non-normalized path -> canonical path. Ancestors are stored too,
+# so locations sharing a prefix only resolve their new components.
+_REALPATH_CACHE = {}
+
+class _SymlinkLoop(Exception):
+    pass
+
+def _canonical_path(path, resolving):
+    """
+    Resolve an absolute path as os.path.realpath does, one component at a
+    time. resolving holds the symlinks being followed, to detect loops.
+    """
+    if path in _REALPATH_CACHE:
+        return _REALPATH_CACHE[path]
+    head, tail = os.path.split(path)
+    if head == path:
+        res = os.path.realpath(path) # The root.
+    elif not tail:
+        res = _canonical_path(head, resolving)
+    else:
+        parent = _canonical_path(head, resolving)
+        if tail == os.curdir:
+            res = parent
+        elif tail == os.pardir:
+            res = os.path.dirname(parent)
+        else:
+            joined = os.path.join(parent, tail)
+            if os.path.islink(joined):
+                if joined in resolving:
+                    raise _SymlinkLoop(joined)
+                resolving.add(joined)
+                try:
+                    target = os.readlink(joined)
+                except OSError:
+                    res = joined
+                else:
+                    res = _canonical_path(
+                        os.path.join(parent, target), resolving)
+                resolving.discard(joined)
+            else:
+                res = joined
+    _REALPATH_CACHE[path] = res
+    return res
+
+def _cached_realpath(path):
+    """
+    os.path.realpath, remembering results, as well as those for all
+    ancestors, for the duration of the run.
+    """
+    abs_path = os.path.join(os.getcwd(), path)
+    try:
+        return _canonical_path(abs_path, set())
+    except _SymlinkLoop:
+        return os.path.realpath(abs_path)
+
+def _fast_join(head, tail):
+    """
+    Join two path parts by concatenation in the common case, deferring to
+    os.path.join when head is empty or ends in a separator, or tail is
+    absolute.
+    """
+    if not head or head.endswith(os.sep) or tail.startswith(os.sep):
+        return os.path.join(head, tail)
+    return head + os.sep + tail
+
+def _is_canonical_subdir(subdir, topdir, strict=False):
+    """
+    Test if subdir is topdir or below it (strictly below it, if strict).
+    Both must be canonical paths: this is a string test, with no syscalls.
+    """
+    if subdir == topdir:
+        return not strict
+    prefix = topdir if topdir.endswith(os.sep) else topdir + os.sep
+    return subdir.startswith(prefix)
+
+@functools.lru_cache(maxsize=64)
+def _dbprefix_pattern(dbprefix):
+    """
+    Pattern excluding db files with the given prefix at the tree root.
+    Shared among trees: Pattern objects are never modified after creation.
+    """
+    return ExcludePattern(f"/{dbprefix}-*.db")
+
+@functools.lru_cache(maxsize=256)
+def _section_pattern(section):
+    return Pattern(section)
+
+@functools.lru_cache(maxsize=4096)
+def _file_key(path):
+    """
+    Return (st_dev, st_ino) identifying the file at path, or None.
+    """
+    try:
+        stat_res = os.stat(path)
+    except OSError:
+        return None
+    return (stat_res.st_dev, stat_res.st_ino)
+
+@functools.lru_cache(maxsize=256)
+def _cached_mode(location, mandatory_mode):
+    """
+    Probe the location mode once per (location, mandatory_mode) pair.
+    Errors are not cached, so they are raised anew on each call.
+    """
+    return mode_from_location(location, mandatory_mode)
+
+class _SectionComparator:
+    """
+    Callable testing if a config file section name matches a dir location,
+    either as the same file or as a glob pattern.
+    """
+    __slots__ = ("location", "_location_key")
+
+    def __init__(self, location):
+        self.location = location
+        self._location_key = _file_key(location)
+
+    def __call__(self, section):
+        if self._location_key is not None \
+                and _file_key(section) == self._location_key:
+            return True
+        return _section_pattern(section).matches_path(self.location)
+
 class TreeLocationAction(ScPosArgAction):
-    def __call__(self, parser, namespace, val, option_string=None):
-        super().__call__(parser, namespace, val, option_string)
-        tree_args = getattr(namespace, "sc_pos_args", [])
-        tree_args = namespace._sc_arparse_scoped_data.sc_pos_args
-        locations_seen = []
-        for tree_arg in tree_args:
-            this_location = tree_arg.real_location
-            if this_location in locations_seen:
-                raise ValueError("duplicate location: " + this_location)
+    @staticmethod
+    def check_duplicates(namespace):
+        """
+        Once parsing is done, raise ValueError if some tree location was
+        given more than once, listing all such locations.
+        """
+        locations_seen = set()
+        duplicates = []
+        for tree_arg in ScPosArgAction.iter_pos_args(namespace):
+            if not isinstance(tree_arg, TreeLocation):
+                continue
+            if tree_arg in locations_seen:
+                if tree_arg.real_location not in duplicates:
+                    duplicates.append(tree_arg.real_location)
             else:
-                locations_seen.append(this_location)
+                locations_seen.add(tree_arg)
+        if duplicates:
+            raise ValueError("duplicate location%s: %s" % \
+                ("s" if len(duplicates) > 1 else "", ", ".join(duplicates)))
 
 class TreeLocation:
     """
@@ -88,7 +221,7 @@ class TreeLocation:
         TreeLocation(loc, mode=ONLINE), even TreeLocation(loc) so long as loc is
         a dir.
         """
-        mode = mode_from_location(location, mandatory_mode)
+        mode = _cached_mode(location, mandatory_mode)
         assert mode in (Mode.ONLINE, Mode.OFFLINE), \
             "__new__: mode must be ONLINE or OFFLINE"
         newcls = {Mode.ONLINE: TreeLocationOnline,
@@ -101,9 +234,20 @@ class TreeLocation:
 
     def __init__(self, location):
         self.cmd_location = location
-        self.real_location = os.path.realpath(self.cmd_location)
-        self.namespace = argparse.Namespace()
-        setattr(self.namespace, "mode", self.mode)
+        self.real_location = _cached_realpath(self.cmd_location)
+        self._hash = hash(self.real_location)
+        self.config_cache = {} # Config file values for this location.
+        self.namespace = argparse.Namespace(mode=self.mode)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        """
+        Tree locations are the same if their canonical paths are.
+        """
+        return isinstance(other, TreeLocation) \
+            and self.real_location == other.real_location
 
     def kws(self):
         """
@@ -120,18 +264,29 @@ class TreeLocation:
         """
         tr1_pats = getattr(tree1.namespace, "exclude_patterns")
         tr2_pats = getattr(tree2.namespace, "exclude_patterns")
+        if tr1_pats is tr2_pats:
+            return
+        if not tr1_pats or not tr2_pats:
+            # Nothing to merge: both trees get the nonempty list, if any.
+            merged_pats = tr1_pats or tr2_pats
+            setattr(tree1.namespace, "exclude_patterns", merged_pats)
+            setattr(tree2.namespace, "exclude_patterns", merged_pats)
+            return
         merged_pats = merge_pattern_lists(tr1_pats, tr2_pats)
         setattr(tree1.namespace, "exclude_patterns", merged_pats)
         setattr(tree2.namespace, "exclude_patterns", merged_pats)
 
 
+# Tree init dbkwargs common to all offline trees, which have no topdir.
+_OFFLINE_DBKWARGS = {"topdir_path": None}
+
 class TreeLocationOffline(TreeLocation):
     def __init__(self, cmd_location):
         super().__init__(cmd_location)
-        setattr(self.namespace, "exclude_patterns", [])
-        setattr(self.namespace, "topdir_path", None)
-        setattr(self.namespace, "dbkwargs", \
-                {"dbpath":self.cmd_location, "topdir_path":None})
+        namespace = self.namespace
+        namespace.exclude_patterns = []
+        namespace.topdir_path = None
+        namespace.dbkwargs = dict(_OFFLINE_DBKWARGS, dbpath=self.cmd_location)
 
 # The following have no effect on offline trees:
     def set_dbprefix(self, _dbprefix):
@@ -154,6 +309,7 @@ class TreeLocationOnline(TreeLocation):
         self._dbprefix = None
         setattr(self.namespace, "topdir_path", self.cmd_location)
         self._alt_dbrootdir = None
+        self._real_alt_dbrootdir = None
 
     def set_dbprefix(self, dbprefix):
         assert self._kws is None, \
@@ -162,7 +318,7 @@ class TreeLocationOnline(TreeLocation):
         append_to_namespace_list(
             self.namespace,
             "exclude_patterns",
-            [ExcludePattern(f"/{dbprefix}-*.db"),])
+            [_dbprefix_pattern(dbprefix),])
 
     def get_dbprefix(self):
         assert self._dbprefix is not None, \
@@ -179,17 +335,23 @@ class TreeLocationOnline(TreeLocation):
             "TLO: cannot set db;location after kwargs generated"
         assert isinstance(dblocation, str), \
             "TLO: dbpath must be a string"
-        if os.path.exists(dblocation) and not os.path.isfile(dblocation):
-            raise ValueError("not a file: " + dblocation)
-        dblocation = os.path.realpath(dblocation)
+        try:
+            dblocation_mode = os.stat(dblocation).st_mode
+        except OSError:
+            pass # Does not exist yet.
+        else:
+            if not stat.S_ISREG(dblocation_mode):
+                raise ValueError("not a file: " + dblocation)
+        dblocation = _cached_realpath(dblocation)
         self.dblocation = dblocation
-        dbdirpath = os.path.dirname(dblocation)
-        relpath = \
-            is_subdir(dbdirpath, self.real_location)
-        if relpath:
-            if os.path.samefile(dbdirpath, self.real_location):
-                relpath = ""
-            relpath = os.path.join(relpath, os.path.basename(dblocation))
+        dbdirpath, dbbasename = os.path.split(dblocation)
+        if _is_canonical_subdir(dbdirpath, self.real_location):
+            # Both paths are canonical: get the relative path by slicing.
+            if dbdirpath == self.real_location:
+                relpath = dbbasename
+            else:
+                prefix_len = len(self.real_location.rstrip(os.sep)) + 1
+                relpath = _fast_join(dbdirpath[prefix_len:], dbbasename)
             setattr(self.namespace,
                     "exclude_patterns",
                     [ExcludePattern(f"/{relpath}"),])
@@ -201,17 +363,20 @@ class TreeLocationOnline(TreeLocation):
         set it as our dbrootdir.
         Prefer more specific dbrootdirs if multiple calls are made.
         """
-        if not is_subdir(self.real_location, alt_dbrootdir):
-#                or os.path.samefile(self.real_location, alt_dbrootdir):
+        real_alt_dbrootdir = _cached_realpath(alt_dbrootdir)
+        if not _is_canonical_subdir(self.real_location, real_alt_dbrootdir):
             pr.trace("dbrootdir does not apply: %s for %s",
                      alt_dbrootdir, self.real_location)
             return
+        # Both are canonical superdirs of real_location, so the more specific
+        # is the longer one.
         if self._alt_dbrootdir is not None \
-               and is_subdir(self._alt_dbrootdir, alt_dbrootdir):
+               and len(self._real_alt_dbrootdir) >= len(real_alt_dbrootdir):
             pr.trace("dbrootdir less specific: %s for %s",
                      alt_dbrootdir, self._alt_dbrootdir)
             return
         self._alt_dbrootdir = alt_dbrootdir
+        self._real_alt_dbrootdir = real_alt_dbrootdir
 
     def set_alt_dbrootdir_parent(self, alt_dbrootdir_parent):
         """
@@ -221,14 +386,15 @@ class TreeLocationOnline(TreeLocation):
         This is used with alt_dbrootdir_parent as the directory
         containing all mountpoints of removable media.
         """
-        if not is_subdir(self.real_location, alt_dbrootdir_parent) \
-           or os.path.samefile(self.real_location, alt_dbrootdir_parent):
+        real_parent = _cached_realpath(alt_dbrootdir_parent)
+        if not _is_canonical_subdir(self.real_location, real_parent,
+                                    strict=True):
             pr.trace("dbrootdir_parent does not apply: %s for %s",
                      alt_dbrootdir_parent, self.real_location)
             return
-        relpath = os.path.relpath(self.real_location, alt_dbrootdir_parent)
+        relpath = os.path.relpath(self.real_location, real_parent)
         subdir = relpath.split(os.sep)[0]
-        self.set_alt_dbrootdir(os.path.join(alt_dbrootdir_parent, subdir))
+        self.set_alt_dbrootdir(_fast_join(alt_dbrootdir_parent, subdir))
 
     def compute_dbdir(self):
         assert self._dbprefix is not None, "TLO: missing dbprefix"
@@ -243,7 +409,7 @@ class TreeLocationOnline(TreeLocation):
             if self.dblocation is None:
                 db_dir = self.compute_dbdir()
                 db_basename = pick_db_basename(db_dir, self._dbprefix)
-                dblocation = os.path.join(db_dir, db_basename)
+                dblocation = _fast_join(db_dir, db_basename)
                 pr.info("using %s for %s" % (dblocation, self.cmd_location))
             else:
                 dblocation = self.dblocation
@@ -264,35 +430,52 @@ class TreeOptionAction(ScOptArgAction):
         Makes a comparator function that will match config file section
         wildcards to the given dir location.
         """
-        def comparator(section, location=location):
-            try:
-                if os.path.samefile(section, location):
-                    return True
-            except OSError:
-                pass
-            pat = Pattern(section)
-            return pat.matches_path(location)
-        return comparator
+        return _SectionComparator(location)
 
     @staticmethod
     def is_config_file_enabled():
         return ArgumentParserConfig.is_active()
 
-    def get_from_tree_section(self, arg_tree, key, merge_sections, type=None):
+    def get_from_tree_section(self, arg_tree, key, merge_sections, type=None,
+                              comparator=None):
         """
         Return value corresponding to key from locations matching arg_tree's
-        real location.
+        real location. A comparator made for arg_tree may be passed in.
+        Results, including missing section or option errors, are cached in
+        arg_tree. Errors are cached as (class, args), and a fresh exception
+        is raised on each hit.
         """
         if type is None:
             type = self.type
-        location = arg_tree.real_location
-        section_name_comparator = TreeOptionAction.make_comparator(location)
-        val = ArgumentParserConfig.get_from_section(
-            key,
-            type=type,
-            section=section_name_comparator,
-            merge_sections=merge_sections,
-            nargs=self.nargs)
+        nargs = self.nargs
+        config_cache = arg_tree.config_cache
+        cache_key = (key, merge_sections, type, nargs)
+        if cache_key in config_cache:
+            val, exc_info = config_cache[cache_key]
+        else:
+            if comparator is None:
+                location = arg_tree.real_location
+                section_name_comparator = \
+                    TreeOptionAction.make_comparator(location)
+            else:
+                section_name_comparator = comparator
+            try:
+                val = ArgumentParserConfig.get_from_section(
+                    key,
+                    type=type,
+                    section=section_name_comparator,
+                    merge_sections=merge_sections,
+                    nargs=nargs)
+            except (NoSectionError, NoOptionError) as exc:
+                val, exc_info = None, (exc.__class__, exc.args)
+            else:
+                exc_info = None
+            config_cache[cache_key] = (val, exc_info)
+        if exc_info is not None:
+            exc_class, exc_args = exc_info
+            raise exc_class(*exc_args)
+        if isinstance(val, list):
+            val = list(val) # Callers may alter the list.
         return val
 
 class ConfigTreeOptionAction(TreeOptionAction):
@@ -300,27 +483,46 @@ class ConfigTreeOptionAction(TreeOptionAction):
     A TreeOptionAction that reads default values from the config file sections
     matching this tree.
     """
+    def _config_keys(self):
+        """
+        Return the list of (option string, config key) pairs, computed once.
+        """
+        keys = getattr(self, "_config_keys_cache", None)
+        if keys is None:
+            keys = []
+            for opt_str in self.option_strings:
+                if opt_str.startswith("--"):
+                    short_opt_str = opt_str[2:]
+                elif opt_str.startswith("-"):
+                    short_opt_str = opt_str[1:]
+                else:
+                    assert False, "unexpected option string: %s" % opt_str
+                keys.append((opt_str, short_opt_str))
+            self._config_keys_cache = keys
+        return keys
+
     def sc_apply_default(self, parser, namespace, pos_val):
         super().sc_apply_default(parser, namespace, pos_val)
         if not self.is_config_file_enabled():
             return
-        for opt_str in self.option_strings:
-            if opt_str.startswith("--"):
-                short_opt_str = opt_str[2:]
-            elif opt_str.startswith("-"):
-                short_opt_str = opt_str[1:]
-            else:
-                assert False, "unexpected option string: %s" % opt_str
+        # Every alias is looked up, since e.g. no-hard-links differs from
+        # hard-links, but one comparator serves them all.
+        comparator = TreeOptionAction.make_comparator(pos_val.real_location)
+        get_from_tree_section = self.get_from_tree_section
+        sc_action = self.sc_action
+        opt_type = self.type
+        for opt_str, short_opt_str in self._config_keys():
             try:
-                vals = self.get_from_tree_section(
+                vals = get_from_tree_section(
                     pos_val,
                     short_opt_str,
-                    type=self.type,
-                    merge_sections=True)
+                    type=opt_type,
+                    merge_sections=True,
+                    comparator=comparator)
             except (NoSectionError, NoOptionError):
                 continue
             try:
-                self.sc_action(
+                sc_action(
                     parser, namespace, pos_val, vals, opt_str)
             except Exception as exc:
                 exc_type = type(exc)
@@ -19,7 +19,6 @@ source, as much as possible.
 # pylint: disable=too-many-instance-attributes
 
 import itertools
-import copy
 from collections import namedtuple
 
 from lnsync_pkg.human2bytes import bytes2human
@@ -31,6 +30,35 @@ from lnsync_pkg.backtracker import SearchState, do_search
 
 SrcTgt = namedtuple("SrcTgt", ["src", "tgt"])
 
+# Maximum number of (src paths, tgt paths) PathOp sequences to keep.
+_PATHOPS_CACHE_SIZE = 4096
+
+class _LazyList:
+    """
+    Cache the values of an iterator as they are first consumed, so that
+    it may be iterated over again, possibly concurrently.
+    """
+    __slots__ = "_iterator", "_values"
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._values = []
+
+    def __iter__(self):
+        values = self._values
+        pos = 0
+        while True:
+            if pos == len(values):
+                if self._iterator is None:
+                    return
+                try:
+                    values.append(next(self._iterator))
+                except StopIteration:
+                    self._iterator = None
+                    return
+            yield values[pos]
+            pos += 1
+
 class TreePairMatcher:
     """
     Match file trees and generate target path sync (mv, ln, rm) commands.
@@ -89,10 +117,12 @@ class TreePairMatcher:
         Generate mkdir/ln commands to create new links.
         """
         ln_map = self.mt_state.total_path_op.ln_map
+        unln_set = self.mt_state.total_path_op.unln_set
+        tgt_tree = self.trees.tgt
         for ln_ref_path in ln_map:
             for new_link_path in ln_map[ln_ref_path]:
-                if self.trees.tgt.path_to_obj(new_link_path):
-                    if new_link_path in self.mt_state.total_path_op.unln_set:
+                if tgt_tree.path_to_obj(new_link_path):
+                    if new_link_path in unln_set:
                         self._rm_in_advance.add(new_link_path)
                         yield self._mk_rm_cmd(new_link_path)
                     else:
@@ -106,6 +136,8 @@ class TreePairMatcher:
         Generate mkdir/mv commands.
         """
         mv_graph = self.mt_state.total_path_op.mv_graph
+        unln_set = self.mt_state.total_path_op.unln_set
+        tgt_tree = self.trees.tgt
         roots = mv_graph.get_all_roots()
         for mv_graph_root in roots:
             # Follow maximal mv_graph path a1->a2->...->an
@@ -118,14 +150,13 @@ class TreePairMatcher:
                     break
                 reversed_rel_mv_pairs.append((curr_path, new_path))
                 curr_path = new_path
-            final_mv_pair = reversed_rel_mv_pairs[-1]
-            final_mv_dest = final_mv_pair[1]
-            if self.trees.tgt.path_to_obj(final_mv_pair[1]):
-                if final_mv_dest in self.mt_state.total_path_op.unln_set:
+            final_mv_dest = reversed_rel_mv_pairs[-1][1]
+            if tgt_tree.path_to_obj(final_mv_dest):
+                if final_mv_dest in unln_set:
                     self._rm_in_advance.add(final_mv_dest)
                     yield self._mk_rm_cmd(final_mv_dest)
                 else:
-                    pr.warning("cannot mv to " + final_mv_pair[1])
+                    pr.warning("cannot mv to " + final_mv_dest)
                     continue
             reversed_rel_mv_pairs.reverse()
             rel_mv_pairs = reversed_rel_mv_pairs
@@ -136,9 +167,10 @@ class TreePairMatcher:
         """
         Generate rm commands.
         """
-        for relpath in self.mt_state.total_path_op.unln_set:
-            if relpath not in self._rm_in_advance:
-                yield self._mk_rm_cmd(relpath)
+        # Runs after the ln and mv generators, so _rm_in_advance is complete.
+        for relpath in \
+                self.mt_state.total_path_op.unln_set - self._rm_in_advance:
+            yield self._mk_rm_cmd(relpath)
 
     def _mk_rm_cmd(self, relpath):
         """
@@ -190,6 +222,21 @@ class PathOp:
             mv_g.add_arrow(st_path.tgt, st_path.src)
             return PathOp(mv_g, {}, set())
 
+    @staticmethod
+    def make_mv_bulk(src_tgt_paths, ln_map=None, unln_set=None):
+        """
+        PathOp for mv {tpath->spath} for each (spath, tpath) pair in
+        src_tgt_paths, building a single mv graph, optionally with the given
+        ln_map and unln_set.
+        """
+        mv_g = OneGraph()
+        for spath, tpath in src_tgt_paths:
+            if spath != tpath: # Arrow from tpath to spath.
+                mv_g.add_arrow(tpath, spath)
+        return PathOp(mv_g,
+                      {} if ln_map is None else ln_map,
+                      set() if unln_set is None else unln_set)
+
     @staticmethod
     def make_unln(*paths):
         """
@@ -245,6 +292,12 @@ class PathOp:
     def is_valid(self):
         return not self.mv_graph.has_cycle()
 
+    def size(self):
+        """
+        Return the number of elementary operations.
+        """
+        return self.mv_graph.size() + len(self.ln_map) + len(self.unln_set)
+
 class State(SearchState):
     """
     State for matching using the backtracker.
@@ -255,8 +308,9 @@ class State(SearchState):
     State data:
         - szhash_stack: stack of pairs of file id lists (src_ids, tgt_ids),
         all identical sizes and hashes in each pair, yet to be matched
-        - cur_srctgt_ids = SrcTgt(srclist, tgtlist): files yet to be matched
-        for the current size-hash values
+        - cur_srctgt_ids = SrcTgt(srcids, tgtids): files yet to be matched
+        for the current size-hash values, each a dict with ids as keys, used
+        as an ordered set
         - total_path_op: graph of target file operations built so far
     Static data:
         - trees: SrcTgt(src_tree, tgt_tree)
@@ -264,7 +318,7 @@ class State(SearchState):
     """
 
     __slots__ = "szhash_stack", "cur_srctgt_ids", "total_path_op", \
-                "trees", "szhash_to_src_ids", "_valid"
+                "trees", "szhash_to_src_ids", "_valid", "_pathops_cache"
 
     def __init__(self, trees):
         """
@@ -277,10 +331,11 @@ class State(SearchState):
         self.szhash_stack = []
         self.szhash_to_ids = {}
         self._init_stack_and_pathop()
-        self.cur_srctgt_ids = SrcTgt((), ())
+        self.cur_srctgt_ids = SrcTgt({}, {})
         self._doing_final_check = False
         self._valid = True
         self.szhash_cur = None
+        self._pathops_cache = {}
 
     def _init_stack_and_pathop(self):
         """
@@ -292,6 +347,13 @@ class State(SearchState):
         for common_sz in sorted(sz1_set.intersection(sz2_set)):
             with pr.ProgressPrefix("size %s:" % (bytes2human(common_sz),)):
                 self._init_stack_and_pathop_persize(common_sz)
+        # Most constrained groups (fewest possible id matchups) go on top of
+        # the stack, to be matched first.
+        szhash_to_ids = self.szhash_to_ids
+        def constraint_key(szhash):
+            ids = szhash_to_ids[szhash]
+            return (len(ids.src) * len(ids.tgt), len(ids.src) + len(ids.tgt))
+        self.szhash_stack.sort(key=constraint_key, reverse=True)
 
     def _init_stack_and_pathop_persize(self, file_sz):
         """
@@ -305,38 +367,34 @@ class State(SearchState):
             # If there are single source and target files for this size,
             # and the paths are the same, do nothing (no hashing required).
             return
-        src_hashes = {self.trees.src.get_prop(f) for f in sz_src_files}
-        tgt_hashes = {self.trees.tgt.get_prop(f) for f in sz_tgt_files}
-        sz_common_hashes = set.intersection(src_hashes, tgt_hashes)
-        def commonhash_to_fileids(tree, file_list):
-            """
-            Return a dict hash->[fileids] with all files whose hash is one
-            of the values in sz_common_hashes (hashes in common for this file
-            size).
-            """
-            hashfileids_dict = {}
-            for file_obj in file_list:
-                hash_val = tree.get_prop(file_obj)
-                if hash_val in sz_common_hashes:
-                    if hash_val in hashfileids_dict:
-                        hashfileids_dict[hash_val].append(file_obj.file_id)
-                    else:
-                        hashfileids_dict[hash_val] = [file_obj.file_id]
-            return hashfileids_dict
-        src_commonhash_to_fileids = \
-            commonhash_to_fileids(self.trees.src, sz_src_files)
-        tgt_commonhash_to_fileids = \
-            commonhash_to_fileids(self.trees.tgt, sz_tgt_files)
-        for hash_val in sz_common_hashes:
+        # Bucket file ids by hash in a single pass over each tree's files.
+        src_hash_to_ids = self._hash_to_fileids(self.trees.src, sz_src_files)
+        tgt_hash_to_ids = self._hash_to_fileids(self.trees.tgt, sz_tgt_files)
+        for hash_val, szhash_fileids_src in src_hash_to_ids.items():
+            szhash_fileids_tgt = tgt_hash_to_ids.get(hash_val)
+            if szhash_fileids_tgt is None:
+                continue
             pr.trace("stack init for (size,hash)=(%d,%d)", file_sz, hash_val)
-            szhash_fileids_src = src_commonhash_to_fileids[hash_val]
-            szhash_fileids_tgt = tgt_commonhash_to_fileids[hash_val]
             srctgt_ids = SrcTgt(szhash_fileids_src, szhash_fileids_tgt)
             szhash = (file_sz, hash_val)
             if not self._init_eliminated_now(srctgt_ids):
                 self.szhash_stack.append(szhash)
                 self.szhash_to_ids[szhash] = srctgt_ids
 
+    @staticmethod
+    def _hash_to_fileids(tree, file_list):
+        """
+        Return a dict hash->[fileids] for the files in file_list.
+        """
+        hashfileids_dict = {}
+        for file_obj in file_list:
+            hash_val = tree.get_prop(file_obj)
+            if hash_val in hashfileids_dict:
+                hashfileids_dict[hash_val].append(file_obj.file_id)
+            else:
+                hashfileids_dict[hash_val] = [file_obj.file_id]
+        return hashfileids_dict
+
     def _init_eliminated_now(self, srctgt_ids):
         """
         Return True if these ids were handled now and need not go to the
@@ -374,26 +432,32 @@ class State(SearchState):
     def down_delta(self, state_delta):
         delta = state_delta
         pr.trace("down: %s", delta)
-        if delta.next_szhash:
-            pr.trace("new sz-hash: %s", delta.next_szhash)
-            assert self.szhash_stack[-1] == delta.next_szhash, \
-                "down_delta: mismatched hashes"
-            self.szhash_cur = self.szhash_stack.pop()
-            self.cur_srctgt_ids = \
-                copy.deepcopy(self.szhash_to_ids[delta.next_szhash])
-        elif delta.skip_ids:
-            pr.trace("ignoring leftover ids: %s", delta.skip_ids)
-            for s_id in delta.skip_ids.src:
-                self.cur_srctgt_ids.src.remove(s_id)
-            for t_id in delta.skip_ids.tgt:
-                self.cur_srctgt_ids.tgt.remove(t_id)
-        elif not delta.final_check:
-            pr.trace("new src-tgt id pair: %s", delta.srctgt_id)
-            self.cur_srctgt_ids.src.remove(delta.srctgt_id.src)
-            self.cur_srctgt_ids.tgt.remove(delta.srctgt_id.tgt)
+        kind = delta.kind
+        if kind == Delta.PATH_OP:
+            srctgt_id = delta.data
+            pr.trace("new src-tgt id pair: %s", srctgt_id)
+            del self.cur_srctgt_ids.src[srctgt_id.src]
+            del self.cur_srctgt_ids.tgt[srctgt_id.tgt]
             self.total_path_op.add(delta.path_op)
             self._valid = self.total_path_op.is_valid()
-            pr.trace("new pathop of size %d", len(str(self.total_path_op)))
+            if pr.trace_enabled():
+                pr.trace("new pathop of size %d", self.total_path_op.size())
+        elif kind == Delta.NEXT_SZHASH:
+            next_szhash = delta.data
+            pr.trace("new sz-hash: %s", next_szhash)
+            assert self.szhash_stack[-1] == next_szhash, \
+                "down_delta: mismatched hashes"
+            self.szhash_cur = self.szhash_stack.pop()
+            szhash_ids = self.szhash_to_ids[next_szhash]
+            self.cur_srctgt_ids = SrcTgt(dict.fromkeys(szhash_ids.src),
+                                         dict.fromkeys(szhash_ids.tgt))
+        elif kind == Delta.SKIP_IDS:
+            skip_ids = delta.data
+            pr.trace("ignoring leftover ids: %s", skip_ids)
+            for s_id in skip_ids.src:
+                del self.cur_srctgt_ids.src[s_id]
+            for t_id in skip_ids.tgt:
+                del self.cur_srctgt_ids.tgt[t_id]
         else:
             pr.trace("final check.")
             self._doing_final_check = True
@@ -403,19 +467,22 @@ class State(SearchState):
     def up_delta(self, state_delta):
         delta = state_delta
         pr.trace("up : %s", delta)
-        if delta.next_szhash:
-            self.szhash_stack.append(delta.next_szhash)
-            self.cur_srctgt_ids = SrcTgt([], [])
-        elif delta.skip_ids:
-            pr.trace("restoring leftover ids: %s", delta.skip_ids)
-            for s_id in delta.skip_ids.src:
-                self.cur_srctgt_ids.src.append(s_id)
-            for t_id in delta.skip_ids.tgt:
-                self.cur_srctgt_ids.tgt.append(t_id)
-        elif not delta.final_check:
-            self.cur_srctgt_ids.src.append(delta.srctgt_id.src)
-            self.cur_srctgt_ids.tgt.append(delta.srctgt_id.tgt)
+        kind = delta.kind
+        if kind == Delta.PATH_OP:
+            srctgt_id = delta.data
+            self.cur_srctgt_ids.src[srctgt_id.src] = None
+            self.cur_srctgt_ids.tgt[srctgt_id.tgt] = None
             self.total_path_op.remove(delta.path_op)
+        elif kind == Delta.NEXT_SZHASH:
+            self.szhash_stack.append(delta.data)
+            self.cur_srctgt_ids = SrcTgt({}, {})
+        elif kind == Delta.SKIP_IDS:
+            skip_ids = delta.data
+            pr.trace("restoring leftover ids: %s", skip_ids)
+            for s_id in skip_ids.src:
+                self.cur_srctgt_ids.src[s_id] = None
+            for t_id in skip_ids.tgt:
+                self.cur_srctgt_ids.tgt[t_id] = None
         else:
             self._doing_final_check = False
         self._valid = True
@@ -430,19 +497,32 @@ class State(SearchState):
         pr.trace("making delta for stack size %d and cur ids: %s",
                  len(self.szhash_stack), self.cur_srctgt_ids)
         if self.cur_srctgt_ids.src and self.cur_srctgt_ids.tgt:
-            src_ids = copy.deepcopy(self.cur_srctgt_ids.src)
-            tgt_ids = copy.deepcopy(self.cur_srctgt_ids.tgt)
+            src_ids = list(self.cur_srctgt_ids.src)
+            tgt_ids = list(self.cur_srctgt_ids.tgt)
             def delta_maker():
+                # A child state depends only on the id pair and PathOp
+                # applied, so a pair seen in an earlier matchup would only
+                # repeat an already failed subtree: skip it, and stop once
+                # every pair has been tried.
+                pairs_to_try = len(src_ids) * len(tgt_ids)
+                pairs_tried = set()
                 for (sids, tids) in self._gen_id_permutations(src_ids, tgt_ids):
-                    for sid, tid in zip(sids, tids):
+                    for srctgt_id in zip(sids, tids):
+                        if srctgt_id in pairs_tried:
+                            continue
+                        pairs_tried.add(srctgt_id)
+                        sid, tid = srctgt_id
+                        # PathOps are built lazily: the canonical mv
+                        # assignment comes first, others only on backtrack.
                         for path_op in self._gen_pathops(sid, tid):
-                            delta = Delta.make_path_op(
+                            yield Delta.make_path_op(
                                 SrcTgt(sid, tid), path_op)
-                        yield delta
+                    if len(pairs_tried) == pairs_to_try:
+                        return
             return delta_maker()
         elif self.cur_srctgt_ids.src or self.cur_srctgt_ids.tgt:
-            src_ids = copy.deepcopy(self.cur_srctgt_ids.src)
-            tgt_ids = copy.deepcopy(self.cur_srctgt_ids.tgt)
+            src_ids = list(self.cur_srctgt_ids.src)
+            tgt_ids = list(self.cur_srctgt_ids.tgt)
             return iter([Delta.make_skip_ids(SrcTgt(src_ids, tgt_ids))])
         elif self.szhash_stack:
             szhash_delta = Delta.make_next_szhash(self.szhash_stack[-1])
@@ -460,15 +540,36 @@ class State(SearchState):
         Each generated PathOp accomplishes that goal using different specific
         mv/ln/unln elementary operations, with some possibly creating mv cycles
         when combined with other PathOps for other file ids.
+
+        PathOps depend only on the two path lists and are never modified once
+        generated, so they are cached and shared among search branches.
         """
         assert isinstance(src_id, int) and isinstance(tgt_id, int), \
             "_gen_pathops: bad ids (%s,%s)." % (src_id, tgt_id)
         src_paths = self.trees.src.id_to_file(src_id).relpaths
         tgt_paths = self.trees.tgt.id_to_file(tgt_id).relpaths
+        cache = self._pathops_cache
+        cache_key = (tuple(src_paths), tuple(tgt_paths))
+        pathops = cache.get(cache_key)
+        if pathops is None:
+            if len(cache) >= _PATHOPS_CACHE_SIZE:
+                del cache[next(iter(cache))] # Evict the oldest entry.
+            pathops = _LazyList(self._make_pathops(src_paths, tgt_paths))
+            cache[cache_key] = pathops
+        return iter(pathops)
+
+    @staticmethod
+    def _make_pathops(src_paths, tgt_paths):
+        """
+        Generate PathOps turning the tgt_paths into the src_paths.
+        See _gen_pathops.
+        """
         some_tgt_path = tgt_paths[0]
-        common_paths = [p for p in src_paths if p in tgt_paths]
-        src_only_paths = [p for p in src_paths if p not in common_paths]
-        tgt_only_paths = [p for p in tgt_paths if p not in common_paths]
+        tgt_paths_set = set(tgt_paths)
+        common_paths = [p for p in src_paths if p in tgt_paths_set]
+        common_paths_set = set(common_paths)
+        src_only_paths = [p for p in src_paths if p not in common_paths_set]
+        tgt_only_paths = [p for p in tgt_paths if p not in common_paths_set]
         if not src_only_paths:
             assert common_paths, \
                 "_gen_pathops: no common paths"
@@ -481,30 +582,26 @@ class State(SearchState):
             # Just mv paths.
             for tgt_paths_order in \
                     itertools.permutations(tgt_only_paths, len(tgt_only_paths)):
-                mv_ops = [PathOp.make_mv(SrcTgt(a, b)) \
-                            for (a, b) in zip(src_only_paths, tgt_paths_order)]
-                yield PathOp.join(*mv_ops)
+                yield PathOp.make_mv_bulk(
+                    zip(src_only_paths, tgt_paths_order))
         elif len(tgt_only_paths) >= len(src_only_paths):
             # Unlink some target paths.
             for tgt_paths_order in \
                     itertools.permutations(tgt_only_paths, len(src_only_paths)):
-                mv_ops = [PathOp.make_mv(SrcTgt(a, b)) \
-                            for (a, b) in zip(src_only_paths, tgt_paths_order)]
-                mv_op = PathOp.join(*mv_ops)
-                ln_op = PathOp.make_unln(\
-                    *[tn for tn in tgt_only_paths if tn not in tgt_paths_order])
-                yield mv_op.add(ln_op)
+                moved_paths = set(tgt_paths_order)
+                yield PathOp.make_mv_bulk(
+                    zip(src_only_paths, tgt_paths_order),
+                    unln_set=\
+                        {tn for tn in tgt_only_paths if tn not in moved_paths})
         else:
             # len(tgt_paths) < len(src_paths), create new links at target.
             for src_paths_order \
                     in itertools.permutations(src_paths, len(tgt_paths)):
-                mv_ops = [PathOp.make_mv(SrcTgt(a, b)) \
-                        for (a, b) in zip(src_paths_order, tgt_paths)]
-                mv_op = PathOp.join(*mv_ops)
-                ln_op = PathOp.make_ln(
-                    some_tgt_path,
-                    [sn for sn in src_paths if sn not in src_paths_order])
-                yield mv_op.add(ln_op)
+                moved_paths = set(src_paths_order)
+                yield PathOp.make_mv_bulk(
+                    zip(src_paths_order, tgt_paths),
+                    ln_map={some_tgt_path:
+                            [sn for sn in src_paths if sn not in moved_paths]})
 
     def _gen_id_permutations(self, src_ids, tgt_ids):
         """
@@ -533,24 +630,24 @@ class State(SearchState):
         """
         def match_either_way(ids1, tree1, ids2, tree2):
             # Assume len(ids1) <= len(ids2).
-            unmt_ids_1 = copy.copy(ids1)
-            unmt_ids_2 = copy.copy(ids2)
             mt_ids_1, mt_ids_2 = [], []
+            # Each path belongs to at most one id2: index ids2 by path.
+            path_to_id2 = {}
+            for id2 in ids2:
+                for path2 in tree2.id_to_file(id2).relpaths:
+                    path_to_id2[path2] = id2
+            used_ids_2 = set()
             for id1 in ids1:
-                id1_matched = False
-                paths1 = tree1.id_to_file(id1).relpaths
-                for path1 in paths1:
-                    for id2 in unmt_ids_2:
-                        paths2 = tree2.id_to_file(id2).relpaths
-                        if path1 in paths2:
-                            mt_ids_1 += [id1]
-                            mt_ids_2 += [id2]
-                            unmt_ids_1.remove(id1)
-                            unmt_ids_2.remove(id2)
-                            id1_matched = True
-                            break
-                    if id1_matched:
+                for path1 in tree1.id_to_file(id1).relpaths:
+                    id2 = path_to_id2.get(path1)
+                    if id2 is not None and id2 not in used_ids_2:
+                        mt_ids_1.append(id1)
+                        mt_ids_2.append(id2)
+                        used_ids_2.add(id2)
                         break
+            used_ids_1 = set(mt_ids_1)
+            unmt_ids_1 = [id1 for id1 in ids1 if id1 not in used_ids_1]
+            unmt_ids_2 = [id2 for id2 in ids2 if id2 not in used_ids_2]
             if mt_ids_1 == []:
                 # No id in ids1 has a path in common with some path in ids2.
                 return iter([])
@@ -579,75 +676,66 @@ class State(SearchState):
                 )
         return res
 
-class Delta:
+_DeltaTuple = namedtuple("_DeltaTuple", ["kind", "data", "path_op"])
+
+class Delta(_DeltaTuple):
     """
     State delta for passing to a child node and back.
 
-    There are four types of Deltas: a Delta has fields new_szhash, srctgt_id,
-    path_op, skip_ids, final_check, interpreted as follows (going down the
-    search tree to a child node).
-    1.If new_szhash is not None, then it is the value at the top of szhash
-    stack.
-    Action: new_szhash is popped from szhash_stack and cur_srctgt_ids is set.
-    2.If srctgt_id is not None, then srctgt_id.src is in cur_srctgt_ids.src and
-    likewise for tgt. Action: srctgt_id.src removed cur_srctgt_ids.src
-    (likewise for tgt) and path_op for this match is merged into total_path_op.
-    3.If skip_ids is not None, it is a SrcTgt pair of lists that were not
-    matched and are to be disregarded. Action: clear srctgt_id.
-    4.If final_check is not None, then the search stack is empty.
+    A Delta is a (kind, data, path_op) tuple. There are four kinds,
+    interpreted as follows (going down the search tree to a child node).
+    1.NEXT_SZHASH: data is the value at the top of szhash stack.
+    Action: data is popped from szhash_stack and cur_srctgt_ids is set.
+    2.PATH_OP: data is a srctgt_id pair, srctgt_id.src is in
+    cur_srctgt_ids.src and likewise for tgt. Action: srctgt_id.src removed
+    cur_srctgt_ids.src (likewise for tgt) and path_op for this match is merged
+    into total_path_op.
+    3.SKIP_IDS: data is a SrcTgt pair of lists that were not matched and are
+    to be disregarded. Action: remove them from cur_srctgt_ids.
+    4.FINAL_CHECK: the search stack is empty.
     Action: the state is flagged as being checked.
     """
 
-    __slots__ = "next_szhash", "srctgt_id", "path_op", "skip_ids", "final_check"
+    __slots__ = ()
+
+    NEXT_SZHASH = 0
+    PATH_OP = 1
+    SKIP_IDS = 2
+    FINAL_CHECK = 3
 
     @staticmethod
     def make_next_szhash(next_szhash):
         """Return a Delta for passing to the next size/hash pair on the stack.
         """
-        newobj = Delta()
-        newobj.next_szhash = next_szhash
-        return newobj
+        return Delta(Delta.NEXT_SZHASH, next_szhash, None)
 
     @staticmethod
     def make_path_op(srctgt_id, path_op):
         """Return a Delta for adding a srcid/tgtid match to the state."""
-
-        newobj = Delta()
-        newobj.srctgt_id = srctgt_id
-        newobj.path_op = path_op
-        return newobj
+        return Delta(Delta.PATH_OP, srctgt_id, path_op)
 
     @staticmethod
     def make_skip_ids(srctgt_ids):
         """Return a Delta for skipping srcids/tgtids."""
-        newobj = Delta()
-        newobj.skip_ids = srctgt_ids
-        return newobj
+        return Delta(Delta.SKIP_IDS, srctgt_ids, None)
 
     @staticmethod
     def make_final_check():
-        """Return a final check Delta."""
-
-        newobj = Delta()
-        newobj.final_check = True
-        return newobj
-
-    def __init__(self):
-        self.next_szhash = None
-        self.srctgt_id = None
-        self.path_op = None
-        self.skip_ids = None
-        self.final_check = False
+        """Return the final check Delta."""
+        return _FINAL_CHECK_DELTA
 
     def __str__(self):
-        if self.next_szhash:
-            return "->szhash: %s" % (self.next_szhash,)
-        elif self.skip_ids:
-            return "-> skip ids: %s" % (self.skip_ids,)
-        elif not self.final_check:
-            return "->%s %s" % (self.srctgt_id, self.path_op)
+        kind = self.kind
+        if kind == Delta.NEXT_SZHASH:
+            return "->szhash: %s" % (self.data,)
+        elif kind == Delta.SKIP_IDS:
+            return "-> skip ids: %s" % (self.data,)
+        elif kind == Delta.PATH_OP:
+            return "->%s %s" % (self.data, self.path_op)
         else:
             return "->final_check"
 
     def __repr__(self):
         return self.__str__()
+
+_FINAL_CHECK_DELTA = Delta(Delta.FINAL_CHECK, None, None)
@@ -12,32 +12,29 @@ Odds and ends.
 import os
 import sys
 import argparse
-from functools import reduce
 import array
 
 MAX_UINT64 = 2**64 - 1
 MAX_INT64 = 2**63 - 1
 MIN_INT64 = -2**63
 
+# The uint/int conversions below are bijections, but not two's complement:
+# values above the signed maximum M map to M - value. Hash values are stored
+# in databases this way, so the mapping must not change.
+
 def uint64_to_int64(value):
-    value = int(value)
-    if value <= MAX_INT64:
-        res = value
-    else:
-        res = MAX_INT64 - value
-    assert MIN_INT64 <= res <= MAX_INT64, \
+    if value > MAX_INT64:
+        value = MAX_INT64 - value
+    assert MIN_INT64 <= value <= MAX_INT64, \
         f"uint64_to_int64 overflow: {value}"
-    return res
+    return value
 
 def int64_to_uint64(value):
-    value = int(value)
-    if value >= 0:
-        res = value
-    else:
-        res = MAX_INT64 - value
-    assert 0 <= res <= MAX_UINT64, \
+    if value < 0:
+        value = MAX_INT64 - value
+    assert 0 <= value <= MAX_UINT64, \
         f"int64_to_uint64 overflow: {value}"
-    return res
+    return value
 
 def uint64_to_bytes(val):
     """
@@ -67,22 +64,18 @@ MAX_INT32 = 2**31 - 1
 MIN_INT32 = -2**31
 
 def uint32_to_int32(value):
-    if value <= MAX_INT64:
-        res = value
-    else:
-        res = MAX_INT32 - value
-    assert MIN_INT32 <= res <= MAX_INT32, \
+    if value > MAX_INT32:
+        value = MAX_INT32 - value
+    assert MIN_INT32 <= value <= MAX_INT32, \
         f"uint32_to_int32 overflow: {value}"
-    return res
+    return value
 
 def int32_to_uint32(value):
-    if value >= 0:
-        res = value
-    else:
-        res = MAX_INT32 - value
-    assert 0 <= res <= MAX_UINT32, \
+    if value < 0:
+        value = MAX_INT32 - value
+    assert 0 <= value <= MAX_UINT32, \
         f"int32_to_uint32 overflow: {value}"
-    return res
+    return value
 
 def argmin(seq, key=None):
     if not seq:
@@ -130,43 +123,62 @@ def wrap_text(text, width):
     breaks are posix newlines (\n).
     By Mike Brown, licensed under the PSF.
     """
-    return reduce(lambda line, word, width=width: '%s%s%s' %
-                  (line,
-                   ' \n'[(len(line)-line.rfind('\n')-1
-                          + len(word.split('\n', 1)[0]
-                               ) >= width)],
-                   word,),
-                  text.split(' '),)
+    words = text.split(' ')
+    parts = [words[0]]
+    col = len(words[0]) - words[0].rfind('\n') - 1 # Current line length.
+    for word in words[1:]:
+        first_nl = word.find('\n')
+        first_seg_len = first_nl if first_nl >= 0 else len(word)
+        if col + first_seg_len >= width:
+            parts.append('\n')
+            col = 0
+        else:
+            parts.append(' ')
+            col += 1
+        parts.append(word)
+        if first_nl >= 0:
+            col = len(word) - word.rfind('\n') - 1
+        else:
+            col += len(word)
+    return ''.join(parts)
 
 def set_exception_hook():
-    def info(exc_type, value, traceback):
+    def info(exc_type, value, exc_tb):
         if hasattr(sys, 'ps1') or not sys.stderr.isatty():
         # we are in interactive mode or we don't have a tty-like
         # device, so we call the default hook
-            sys.__excepthook__(exc_type, value, traceback)
+            sys.__excepthook__(exc_type, value, exc_tb)
         else:
             import traceback
             import pdb
             # we are NOT in interactive mode, print the exception...
-            traceback.print_exception(exc_type, value, traceback)
+            traceback.print_exception(exc_type, value, exc_tb)
             # ...then start the debugger in post-mortem mode.
             # pdb.pm() # deprecated
-            pdb.post_mortem(traceback) # more "modern"
+            pdb.post_mortem(exc_tb) # more "modern"
     sys.excepthook = info
 
+def is_subdir_fast(subdir, topdir):
+    """
+    Like is_subdir, for paths already normalized and either both absolute or
+    both relative to the same dir: a string test, with no syscalls.
+    """
+    if subdir == topdir:
+        return os.curdir
+    if topdir.endswith(os.sep):
+        prefix_len = len(topdir)
+    else:
+        prefix_len = len(topdir) + 1
+    if subdir.startswith(topdir) and subdir[prefix_len-1:prefix_len] == os.sep:
+        return subdir[prefix_len:] or os.curdir
+    return False
+
 def is_subdir(subdir, topdir):
     """
     Test if subdir is topdir or a subdir of topdir.
     Return either False or the relative path (which is never an empty string).
     """
-
-    assert os.path.isdir(subdir) and os.path.isdir(topdir), \
-        f"is_subdir: expected dirs, got: '{subdir}' and '{topdir}'"
-    relative = os.path.relpath(subdir, topdir) # (path, start)
-    if relative.startswith(os.pardir + os.sep):
-        return False
-    else:
-        return relative
+    return is_subdir_fast(os.path.abspath(subdir), os.path.abspath(topdir))
 
 def is_subdir_strict(subdir, topdir):
     return is_subdir(subdir, topdir) and not os.path.samefile(subdir, topdir)
@@ -191,10 +203,14 @@ class ListContextManager:
         return self.objs_entered
 
     def __exit__(self, exc_type, exc_value, traceback):
-        res = False # By default, the exception is not suppressed.
-        for obj in reversed(self.objs_entered):
-            res = res or obj.__exit__(exc_type, exc_value, traceback)
-        return res
+        objs_entered = self.objs_entered
+        if not objs_entered:
+            return False
+        # Exit every object, even if an earlier one suppresses the exception.
+        suppress = False # By default, the exception is not suppressed.
+        for obj in reversed(objs_entered):
+            suppress |= bool(obj.__exit__(exc_type, exc_value, traceback))
+        return suppress
 
 class StoreBoolAction(argparse.Action):
     """
@@ -204,13 +220,12 @@ class StoreBoolAction(argparse.Action):
 
     def __init__(self, *args, nargs=0, **kwargs):
         super().__init__(*args, nargs=0, **kwargs)
+        # Map each option string to the value it stores.
+        self._polarity = {opt: not opt.startswith("--no-")
+                          for opt in self.option_strings}
 
     def __call__(self, parser, namespace, pos_arg, option_string=None):
-        if option_string and option_string[0:5] == "--no-":
-            val = False
-        else:
-            val = True
-        setattr(namespace, self.dest, val)
+        setattr(namespace, self.dest, self._polarity.get(option_string, True))
 
 class BitField:
     """
@@ -232,25 +247,28 @@ class BitField:
         if isinstance(index, slice):
             self.__setslice__(index.start, index.stop, value)
         else:
-            value = (value & 1) << index
-            mask = 1 <<index
-            self._d = (self._d & ~mask) | value
+            mask = 1 << index
+            if value & 1:
+                self._d |= mask
+            else:
+                self._d &= ~mask
 
     def __getslice__(self, start, end):
-        mask = 2**(end - start) -1
-        return (self._d >> start) & mask
+        return (self._d >> start) & ((1 << (end - start)) - 1)
 
     def __setslice__(self, start, end, value):
-        mask = 2**(end - start) -1
-        value = (value & mask) << start
-        mask = mask << start
-        self._d = (self._d & ~mask) | value
-        return (self._d >> start) & mask
+        mask = ((1 << (end - start)) - 1) << start
+        self._d = (self._d & ~mask) | ((value << start) & mask)
 
     def __int__(self):
         return self._d
 
 def append_to_namespace_list(namespace, key, more_items):
+    """
+    Set namespace.key to a new list, the previous list plus more_items.
+    The previous list is never modified: it may be a shared default or
+    shared by several tree namespaces.
+    """
     prev_items = getattr(namespace, key, None)
     if prev_items is None: # It could have been None before.
         prev_items = []
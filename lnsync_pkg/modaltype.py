@@ -125,6 +125,8 @@ class Mode(Enum):
     OFFLINE = 2
 # TODO: Customize modes.
 
+_type_call = type.__call__
+
 class modaltype(type):
     """
     Metaclass for modal classes.
@@ -136,9 +138,8 @@ class modaltype(type):
         """
         Get the mode declension of non_class, creating it if needed.
         """
-        if mode in none_class._modal_declensions:
-            modal_cls = none_class._modal_declensions[mode]
-        else:
+        modal_cls = none_class._modal_declensions.get(mode)
+        if modal_cls is None:
             new_cls_name = none_class.__name__ + "_" + mode.name
             # Call the correct metaclass to create a dummy modal class.
             modal_cls = \
@@ -153,20 +154,26 @@ class modaltype(type):
         If given_cls is a mode NONE class, select the required declension class,
         if one exists, or create one if needed.
         """
-        if given_cls.mode is Mode.NONE: # We are given a mode None class
-            if mode in (None, Mode.NONE):
+        cls_mode = given_cls.mode
+        if mode is None or mode is cls_mode:
+            # No mode requested, or given_cls already has that mode.
+            modal_cls = given_cls
+        elif cls_mode is Mode.NONE: # We are given a mode None class
+            if mode is Mode.NONE:
                 modal_cls = given_cls
             else:
-                assert isinstance(mode, Mode), \
-                    f"__call__: invalid mode: {mode}"
-                modal_cls = modaltype._get_declension(given_cls, mode)
+                # Fast path: the declension usually exists already.
+                modal_cls = given_cls._modal_declensions.get(mode)
+                if modal_cls is None:
+                    assert isinstance(mode, Mode), \
+                        f"__call__: invalid mode: {mode}"
+                    modal_cls = modaltype._get_declension(given_cls, mode)
         else:
-            assert mode is None or given_cls.mode == mode, \
+            assert cls_mode == mode, \
                 "mismatched modes"
             modal_cls = given_cls
         # At this point, modal_cls has the mode attribute correctly set.
-        res = type.__call__(modal_cls, *args, **kwargs) # Create and init.
-        return res
+        return _type_call(modal_cls, *args, **kwargs) # Create and init.
 
     def __new__(mcs, name, bases, attrs, *_args, mode=Mode.NONE, **_kwargs):
         """
@@ -36,7 +36,9 @@ class OneGraph:
 
     def __init__(self):
         self._arrows = {} # Set of arrows as dictionary {node_from:node_to, ...}.
-        self._cycles = [] # List of cycles, each cycle a set of nodes.
+        # Cycles, each a set of nodes, indexed by node. In a one-graph, cycles
+        # are disjoint, so each node is in at most one.
+        self._node_to_cycle = {}
 
     def __str__(self):
         return str(self._arrows)
@@ -45,27 +47,34 @@ class OneGraph:
         """
         If a->b is in the graph, return b, else return None.
         """
-        if node_a in self._arrows:
-            return self._arrows[node_a]
-        else:
-            return None
+        return self._arrows.get(node_a)
+
+    def size(self):
+        """
+        Return the number of arrows.
+        """
+        return len(self._arrows)
 
     def has_cycle(self):
-        return self._cycles
+        return bool(self._node_to_cycle)
 
     def iter_arrows(self):
-        for node_a, node_b in self._arrows.items():
-            yield (node_a, node_b)
+        """
+        Return an iterable over (node_a, node_b) pairs, one per arrow a->b.
+        The graph must not be changed while iterating.
+        """
+        return self._arrows.items()
 
     def add_arrow(self, node_a, node_b):
         assert not node_a in self._arrows, \
             "OneGraph.add_arrow: arrow already in"
         self._arrows[node_a] = node_b
-        cyc = self._cycle_from_list(node_b)
-        if cyc is not None: # There's a cycle. Is it a new one?
-            elem = cyc[0] # Pick any elem in the found cycle.
-            if not any((elem in old_cyc) for old_cyc in self._cycles):
-                self._cycles.append(set(cyc))
+        # Since node_a had no arrow out, any new cycle goes through it.
+        cyc = self._cycle_through(node_a)
+        if cyc is not None:
+            node_to_cycle = self._node_to_cycle
+            for node in cyc:
+                node_to_cycle[node] = cyc
 
     def add_graph(self, other_one_g):
         """
@@ -81,10 +90,11 @@ class OneGraph:
             and self._arrows[node_a] == node_b, \
                 "OneGraph.remove_arrow: arrow not in"
         del self._arrows[node_a]
-        for k, cycle in enumerate(self._cycles): # Remove at most one cycle.
-            if node_a in cycle:
-                del self._cycles[k]
-                break
+        cycle = self._node_to_cycle.get(node_a)
+        if cycle is not None: # Remove at most one cycle.
+            node_to_cycle = self._node_to_cycle
+            for node in cycle:
+                del node_to_cycle[node]
 
     def remove_graph(self, other_one_g):
         """
@@ -117,23 +127,18 @@ class OneGraph:
                 leaves.discard(node)
         return leaves
 
-    def _cycle_from_list(self, node):
+    def _cycle_through(self, node):
         """
-        Return a (list) cycle starting at e, if one exists, None otherwise.
+        Return the set of nodes of the cycle through node, if one exists,
+        None otherwise. Only the path out of node is walked.
         """
         arrow_gr = self._arrows
-        if len(arrow_gr) <= 1:
+        cycle = {node}
+        nxt = arrow_gr.get(node)
+        while nxt is not None and nxt not in cycle:
+            cycle.add(nxt)
+            nxt = arrow_gr.get(nxt)
+        if nxt is None or nxt != node:
+            # Either a dead end, or we ran into a cycle not through node.
             return None
-        stack = [node]
-        while True:
-            top = stack[-1]
-            if top in arrow_gr:        # There is a next node.
-                nxt = arrow_gr[top]
-                if nxt in stack:
-                    pos = stack.index(nxt)
-                    return stack[pos:]
-                else:
-                    stack.append(nxt)
-            else:
-                break
-        return None
+        return cycle
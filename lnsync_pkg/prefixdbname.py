@@ -12,8 +12,8 @@ Database filenames match <PREFIX>-[0-9]*.db
 # pylint: global-statement
 
 import os
-import random
 import re
+import stat
 
 from lnsync_pkg.modaltype import Mode
 
@@ -40,16 +40,22 @@ def mode_from_location(location, mandatory_mode=Mode.NONE):
     """
     assert isinstance(mandatory_mode, Mode), \
         f"mode_from_location: not a mode: {mandatory_mode}"
+    try:
+        loc_mode = os.stat(location).st_mode
+    except (OSError, ValueError):
+        loc_mode = None # Treat as nonexistent, like os.path.exists.
+    is_dir = loc_mode is not None and stat.S_ISDIR(loc_mode)
+    is_file = loc_mode is not None and stat.S_ISREG(loc_mode)
     if mandatory_mode is Mode.NONE:
-        if os.path.isdir(location):
+        if is_dir:
             mandatory_mode = Mode.ONLINE
-        elif os.path.isfile(location):
+        elif is_file:
             mandatory_mode = Mode.OFFLINE
         else:
             msg = "expected file or dir: " + location
             raise ValueError(msg)
     if mandatory_mode == Mode.ONLINE:
-        if not os.path.isdir(location):
+        if not is_dir:
             msg = "expected tree root dir: " + location
             raise ValueError(msg)
         elif not os.access(location, os.R_OK):
@@ -57,8 +63,8 @@ def mode_from_location(location, mandatory_mode=Mode.NONE):
             raise ValueError(msg)
         mode = Mode.ONLINE
     elif mandatory_mode == Mode.OFFLINE:
-        if os.path.exists(location):
-            if not os.path.isfile(location):
+        if loc_mode is not None:
+            if not is_file:
                 msg = "expected offline tree file: " + location
                 raise ValueError(msg)
             elif not os.access(location, os.R_OK):
@@ -82,10 +88,13 @@ def pick_db_basename(dir_path, dbprefix=None):
     pattern = r"^%s-\d+.db$" % (dbprefix,)
     regex = re.compile(pattern)
     candidates_base = []
-    for basename in os.listdir(dir_path):
-        if os.path.isfile(os.path.join(dir_path, basename)) \
-                and regex.match(basename):
-            candidates_base.append(basename)
+    with os.scandir(dir_path) as dir_entries:
+        for entry in dir_entries:
+            # Match the name first: is_file may still need a stat.
+            if regex.match(entry.name) and entry.is_file():
+                candidates_base.append(entry.name)
+                if len(candidates_base) > 1:
+                    break # Too many already.
     if len(candidates_base) == 1:
         db_basename = candidates_base[0]
     elif candidates_base == []:
@@ -96,7 +105,8 @@ def pick_db_basename(dir_path, dbprefix=None):
             """
             Return a random string of digits of length ndigit.
             """
-            return ("%%0%dd" % ndigit) % random.randint(0, 10**ndigit-1)
+            import random # Only needed when creating a new database.
+            return f"{random.randint(0, 10**ndigit-1):0{ndigit}d}"
         db_basename = dbprefix + "-" + random_digit_str() + ".db"
     else:
         raise RuntimeError("too many db files at " + dir_path)
@@ -209,6 +209,10 @@ def debug(template_str, *str_args, **kwargs):
             msg = "failed printing debug string '%s'" % (template_str,)
             raise RuntimeError(msg) from exc
 
+def trace_enabled():
+    """Return True if trace output is on, to skip building costly args."""
+    return option_verbosity >= TRACE_LEVEL
+
 def trace(template_str, *str_args, **kwargs):
     """Templace with % placeholders and respective are given separately."""
     if option_verbosity >= TRACE_LEVEL:
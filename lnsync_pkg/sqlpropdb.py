@@ -336,25 +336,29 @@ class SQLPropDBManager(PropDBManager):
         self._cx.execute("VACUUM;")
 
     def import_table_from_external_file(self, table_name, external_db_file):
+        """
+        Copy all rows from the same table in another database file,
+        overwriting rows with the same key, in a single SQL statement.
+        """
         self._cx.execute("ATTACH ? AS SOURCE;", (external_db_file,))
-        self._cx.execute(
-            f"DELETE FROM {table_name} " \
-            f"WHERE file_id IN (SELECT file_id FROM SOURCE.{table_name}) ;")
-        self._cx.execute(
-            f"INSERT INTO {table_name} SELECT * FROM SOURCE.{table_name} ;")
+        try:
+            self._cx.execute(
+                f"INSERT OR REPLACE INTO {table_name} " \
+                f"SELECT * FROM SOURCE.{table_name} ;")
+        except sqlite3.Error:
+            self._cx.rollback()
+            raise
+        else:
+            self._cx.commit()
+        finally:
+            self._cx.execute("DETACH SOURCE;")
 
     def update_table_from_list(self, table_name, values):
-        test_cursor = self._cx.cursor()
-        test_cursor.executemany(
-            f"SELECT * FROM {table_name} WHERE file_id=?;",
-            [(res[0],) for res in values])
-        existing_records = test_cursor.fetchall()
-        test_cursor.executemany(
-            f"DELETE FROM {table_name} WHERE file_id=?;",
-            [rec[0] for rec in existing_records])
-        put_cursor = self._cx.cursor()
-        put_cursor.executemany(
-            f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, ?);",
+        """
+        Insert rows, overwriting rows with the same key.
+        """
+        self._cx.executemany(
+            f"INSERT OR REPLACE INTO {table_name} VALUES (?, ?, ?, ?, ?);",
             values)
 
     def merge_prop_values_into(self, tgt_db, remap_id_fn=None, filter_fn=None):